@@ -1,15 +1,159 @@
 #!/usr/bin/env python3
 """
 Simple script to concatenate all files in the outputs folder
-Usage: python concat_all.py <output_filename>
+Usage: python concat_all.py <output_filename> [--incremental | --watch [--interval SECONDS]]
+       python concat_all.py <output_filename> --list
+       python concat_all.py <output_filename> --get <report_name>
+
+Files are copied in fixed-size chunks (zero-copy where the OS supports it), so memory use
+stays flat however large the outputs folder is. A sidecar <output_filename>.index.json records
+the byte offset and length of every report so one can be read back without rescanning.
+
+With --incremental or --watch the index doubles as a manifest (size, mtime and SHA-256 of every
+source file; plain runs skip the hashing so each report is read only once): --incremental
+keeps the unchanged leading part of the combined file, overwrites same-size changes in place
+and rewrites only from the first report that moved, which is a plain append when new reports
+sort last. --watch polls outputs/ and applies those updates as reports are written.
 """
 
+import argparse
+import hashlib
+import json
+import mmap
 import os
 import sys
+import time
 from pathlib import Path
 
-def concat_all_outputs(output_file):
-    """Concatenate all markdown files in outputs folder"""
+CHUNK_SIZE = 1024 * 1024
+INDEX_SUFFIX = ".index.json"
+
+def separator(name):
+    """Banner written before every file except the first"""
+    return ("\n\n" + "="*60 + "\n" + f"FILE: {name}\n" + "="*60 + "\n\n").encode('utf-8')
+
+def index_path(output_file):
+    return f"{output_file}{INDEX_SUFFIX}"
+
+def _copy_file_range(src, dst, offset, count):
+    return os.copy_file_range(src.fileno(), dst.fileno(), count, offset)
+
+def _sendfile(src, dst, offset, count):
+    return os.sendfile(dst.fileno(), src.fileno(), offset, count)
+
+def copy_contents(src, dst, size):
+    """Append the first size bytes of src to dst and return how many were copied
+    
+    Tries copy_file_range, then sendfile, then falls back to a chunked read/write loop; each
+    method picks up where the previous one stopped. dst must be unbuffered so its file position
+    stays in step with the zero-copy calls.
+    """
+    copied = 0
+    for zero_copy in (_copy_file_range, _sendfile):
+        try:
+            while copied < size:
+                sent = zero_copy(src, dst, copied, size - copied)
+                if sent == 0:
+                    return copied
+                copied += sent
+            return copied
+        except (AttributeError, OSError):
+            # Not available on this platform or for this pair of files
+            continue
+    
+    src.seek(copied)
+    while copied < size:
+        chunk = src.read(min(CHUNK_SIZE, size - copied))
+        if not chunk:
+            break
+        dst.write(chunk)
+        copied += len(chunk)
+    return copied
+
+def file_digest(path):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_index(output_file):
+    """Sidecar index of output_file, or None if it is missing, unreadable or out of step with the file"""
+    try:
+        with open(index_path(output_file), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if os.path.getsize(output_file) != index["size"]:
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    # Indexes from before the manifest fields can't be compared against the sources
+    if not all("hash" in entry for entry in index["reports"]):
+        return None
+    return index
+
+def segment_start(entries, i):
+    """Offset where report i's segment (its separator, then its contents) begins"""
+    if i == 0:
+        return 0
+    return entries[i]["offset"] - len(separator(entries[i]["name"]))
+
+def write_index(output_file, entries, total_size):
+    """Atomically write the sidecar offset index for output_file"""
+    path = index_path(output_file)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({"output": os.path.basename(output_file), "size": total_size, "reports": entries}, f, indent=1)
+    os.replace(temp_path, path)
+
+def copy_report(file_path, outfile, manifest=False):
+    """Copy one source file to outfile's position and return its index entry
+    
+    With manifest the entry also gets the source's hash, which costs a second read of the file;
+    entries without one make the next incremental run rebuild (see load_index).
+    """
+    stat = file_path.stat()
+    with open(file_path, 'rb') as infile:
+        offset = outfile.tell()
+        length = copy_contents(infile, outfile, stat.st_size)
+    entry = {"name": file_path.name, "offset": offset, "length": length,
+             "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if manifest:
+        entry["hash"] = file_digest(file_path)
+    return entry
+
+def plan_update(md_files, previous):
+    """Compare the sources with the previous manifest
+    
+    Returns (kept, in_place): kept holds index entries for the leading reports that can stay
+    where they are, and in_place the positions among them whose contents changed without
+    changing size. Everything after kept has to be rewritten.
+    """
+    kept = []
+    in_place = []
+    for i, file_path in enumerate(md_files):
+        if i >= len(previous) or previous[i]["name"] != file_path.name:
+            break
+        entry = previous[i]
+        stat = file_path.stat()
+        if (stat.st_size, stat.st_mtime_ns) == (entry["size"], entry["mtime_ns"]):
+            kept.append(entry)
+            continue
+        if stat.st_size != entry["size"] or entry["length"] != entry["size"]:
+            break
+        # Same size, new mtime: only the hash tells whether the contents really changed
+        digest = file_digest(file_path)
+        if digest != entry["hash"]:
+            in_place.append(i)
+        kept.append(dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns, hash=digest))
+    return kept, in_place
+
+def concat_all_outputs(output_file, incremental=False):
+    """Concatenate all markdown files in outputs folder
+    
+    With incremental, an output file whose index still matches it is updated in place instead
+    of being rewritten. Returns True if the combined file changed.
+    """
     
     outputs_dir = Path("outputs")
     
@@ -18,34 +162,183 @@ def concat_all_outputs(output_file):
     
     if not md_files:
         print("No markdown files found in outputs directory!")
-        return
+        return False
+    
+    index = load_index(output_file) if incremental else None
+    previous = index["reports"] if index else []
+    kept, in_place = plan_update(md_files, previous)
+    tail = md_files[len(kept):]
     
-    print(f"Concatenating {len(md_files)} files:")
+    if index and not in_place and not tail and len(kept) == len(previous):
+        print(f"Up to date: {output_file} ({len(md_files)} files)")
+        return False
     
-    with open(output_file, 'w', encoding='utf-8') as outfile:
-        for i, file_path in enumerate(md_files):
+    if index:
+        current = {file_path.name for file_path in md_files}
+        removed = [entry["name"] for entry in previous if entry["name"] not in current]
+        print(f"Updating {output_file}: {len(kept) - len(in_place)} unchanged, {len(in_place)} updated in place, "
+              f"{len(tail)} rewritten, {len(removed)} removed")
+        for i in in_place:
+            print(f"  ~ {md_files[i].name}")
+        for file_path in tail:
+            print(f"  + {file_path.name}")
+        for name in removed:
+            print(f"  - {name}")
+        # A crash mid-update must not leave an index describing bytes that have moved
+        os.remove(index_path(output_file))
+    else:
+        print(f"Concatenating {len(md_files)} files:")
+        for file_path in md_files:
             print(f"  - {file_path.name}")
-            
+    
+    entries = list(kept)
+    # Unbuffered, so separators and zero-copied contents land in order
+    with open(output_file, 'r+b' if index else 'wb', buffering=0) as outfile:
+        for i in in_place:
+            outfile.seek(entries[i]["offset"])
+            entries[i] = dict(copy_report(md_files[i], outfile, manifest=True), offset=entries[i]["offset"])
+        
+        # Drop everything from the first report that moved, then append the rest
+        start = segment_start(previous, len(kept)) if len(kept) < len(previous) else (index["size"] if index else 0)
+        outfile.seek(start)
+        outfile.truncate()
+        for i, file_path in enumerate(tail, start=len(kept)):
             # Add separator between files (except first one)
             if i > 0:
-                outfile.write("\n\n" + "="*60 + "\n")
-                outfile.write(f"FILE: {file_path.name}\n")
-                outfile.write("="*60 + "\n\n")
+                outfile.write(separator(file_path.name))
             
-            # Read and write file content
-            with open(file_path, 'r', encoding='utf-8') as infile:
-                outfile.write(infile.read())
+            # Copy file content without loading it into memory
+            entries.append(copy_report(file_path, outfile, manifest=incremental))
+        
+        file_size = outfile.seek(0, os.SEEK_END)
+    
+    write_index(output_file, entries, file_size)
     
     # Show result
-    file_size = os.path.getsize(output_file)
-    print(f"\nCreated: {output_file}")
+    print(f"\n{'Updated' if index else 'Created'}: {output_file}")
+    print(f"Index: {index_path(output_file)}")
     print(f"Size: {file_size:,} bytes")
+    return True
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python concat_all.py <output_filename>")
-        print("Example: python concat_all.py combined_files.md")
+def snapshot_outputs():
+    """(name, size, mtime) of every markdown file in the outputs folder"""
+    snapshot = []
+    for file_path in sorted(Path("outputs").glob("*.md")):
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            continue
+        snapshot.append((file_path.name, stat.st_size, stat.st_mtime_ns))
+    return snapshot
+
+def watch_outputs(output_file, interval=2.0):
+    """Keep output_file current by polling the outputs folder until interrupted
+    
+    A change is applied once two consecutive polls agree, so reports still being written
+    are not copied half-finished.
+    """
+    print(f"Watching outputs/ every {interval:g}s (Ctrl+C to stop)")
+    concat_all_outputs(output_file, incremental=True)
+    applied = snapshot_outputs()
+    pending = None
+    try:
+        while True:
+            time.sleep(interval)
+            current = snapshot_outputs()
+            if current == applied:
+                pending = None
+            elif current != pending:
+                pending = current
+            else:
+                concat_all_outputs(output_file, incremental=True)
+                applied, pending = current, None
+    except KeyboardInterrupt:
+        print("\nStopped watching")
+
+class ConcatReader:
+    """Random access to the reports inside a concatenated file through its sidecar index
+    
+    The file is memory-mapped, so reading one report touches only that report's pages.
+    """
+    
+    def __init__(self, output_file):
+        self.output_file = output_file
+        try:
+            with open(index_path(output_file), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            raise ValueError(f"No index for {output_file}; rerun concat_all.py to create it")
+        self.reports = {entry["name"]: entry for entry in index["reports"]}
+        self._file = open(output_file, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size != index["size"]:
+            self._file.close()
+            raise ValueError(f"{output_file} has changed since it was indexed; rerun concat_all.py")
+        # mmap rejects empty files
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+    
+    def names(self):
+        return list(self.reports)
+    
+    def read_bytes(self, name):
+        entry = self.reports.get(name)
+        if entry is None:
+            raise KeyError(name)
+        return self._map[entry["offset"]:entry["offset"] + entry["length"]]
+    
+    def read(self, name):
+        """Text of the report that came from outputs/<name>"""
+        return self.read_bytes(name).decode('utf-8')
+    
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Concatenate outputs/*.md, or read one report back from the result")
+    parser.add_argument("output_filename", help="Concatenated file to write (or read with --list/--get)")
+    parser.add_argument("--list", action="store_true", help="List the reports in an existing concatenated file")
+    parser.add_argument("--get", metavar="REPORT_NAME", help="Print one report from an existing concatenated file")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only rewrite the reports that changed since the last run (uses the index as a manifest)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep the concatenated file up to date as reports are written to outputs/")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between --watch polls")
+    args = parser.parse_args()
+    
+    if args.interval <= 0:
+        print("Error: --interval must be positive")
         sys.exit(1)
     
-    output_filename = sys.argv[1]
-    concat_all_outputs(output_filename)
\ No newline at end of file
+    if args.watch:
+        watch_outputs(args.output_filename, args.interval)
+        return
+    
+    if not (args.list or args.get):
+        concat_all_outputs(args.output_filename, args.incremental)
+        return
+    
+    try:
+        with ConcatReader(args.output_filename) as reader:
+            if args.list:
+                for name, entry in reader.reports.items():
+                    print(f"{name}\t{entry['offset']}\t{entry['length']}")
+            else:
+                sys.stdout.buffer.write(reader.read_bytes(args.get))
+                sys.stdout.flush()
+    except KeyError as e:
+        print(f"Error: No report named {e} in {args.output_filename}")
+        sys.exit(1)
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -6,35 +6,1453 @@ Spawns agents for research and general task delegation with iterative quality im
 
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import random
 import sys
 import argparse
+import hashlib
 import json
+import mmap
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 import re
+import sqlite3
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:  # Windows: key rotation state stays in-process
+    fcntl = None
 
 # Load environment variables
 load_dotenv()
 
+class KeyRotationCounter:
+    """Monotonic key rotation counter shared across threads and, where flock exists, processes
+    
+    The counter is an 8-byte integer in an mmap'd state file. Each increment takes an exclusive
+    flock on that file, so parallel processes never hand out the same position twice.
+    """
+    
+    def __init__(self, path=None, initial=0):
+        self._lock = threading.Lock()
+        self._value = initial
+        self._fd = None
+        self._map = None
+        
+        if path and fcntl:
+            try:
+                self._open(path, initial)
+            except OSError as e:
+                print(f"Warning: Could not open key state file {path}: {e}")
+    
+    def _open(self, path, initial):
+        """Open (and seed if new) the shared state file"""
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < 8:
+                    os.ftruncate(fd, 8)
+                    os.pwrite(fd, struct.pack('<Q', initial), 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(fd, 8)
+        except OSError:
+            os.close(fd)
+            raise
+        self._fd = fd
+    
+    def next(self, count=1):
+        """Reserve count consecutive positions and return the first one"""
+        with self._lock:
+            if self._map is None:
+                value = self._value
+                self._value += count
+                return value
+            
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                value = struct.unpack_from('<Q', self._map)[0]
+                struct.pack_into('<Q', self._map, 0, value + count)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            return value
+    
+    def peek(self):
+        """Return the next position without reserving it"""
+        with self._lock:
+            if self._map is None:
+                return self._value
+            return struct.unpack_from('<Q', self._map)[0]
+    
+    def close(self):
+        """Release the mmap and state file"""
+        with self._lock:
+            if self._map is not None:
+                self._value = struct.unpack_from('<Q', self._map)[0]
+                self._map.close()
+                os.close(self._fd)
+                self._map = None
+                self._fd = None
+
+class KeyHealthRegistry:
+    """Per-key health: timed cooldowns after rate limits, session ejection after repeated
+    invalid-key errors, and success rate / latency stats used to prefer healthy, fast keys
+    
+    Cooldowns are kept per model, since each model has its own quota on a key.
+    """
+    
+    def __init__(self, key_count, cooldown=60, eject_after=3, latency_alpha=0.3):
+        self._lock = threading.Lock()
+        self.cooldown = cooldown
+        self.eject_after = eject_after
+        self.latency_alpha = latency_alpha
+        self._stats = {
+            key_number: {
+                "successes": 0,
+                "failures": 0,
+                "latency": None,
+                "cooldowns": {},
+                "invalid_streak": 0,
+                "ejected": False
+            }
+            for key_number in range(1, key_count + 1)
+        }
+    
+    def is_available(self, key_number, model=None):
+        """True if the key is neither ejected nor cooling down for model"""
+        with self._lock:
+            return self._is_available(self._stats[key_number], model, time.monotonic())
+    
+    def _is_available(self, stats, model, now):
+        return not stats["ejected"] and stats["cooldowns"].get(model, 0.0) <= now
+    
+    def _score(self, stats):
+        """Higher is better: smoothed success rate divided by smoothed latency"""
+        success_rate = (stats["successes"] + 1) / (stats["successes"] + stats["failures"] + 2)
+        known = [s["latency"] for s in self._stats.values() if s["latency"] is not None]
+        default_latency = sorted(known)[len(known) // 2] if known else 1.0
+        latency = stats["latency"] if stats["latency"] is not None else default_latency
+        return success_rate / max(latency, 0.001)
+    
+    def rank(self, candidates, model=None):
+        """Usable keys from candidates (in rotation order), healthiest of the first two moved to the front
+        
+        Comparing only the next two candidates steers traffic toward fast keys without piling
+        every request onto a single key.
+        """
+        with self._lock:
+            now = time.monotonic()
+            usable = [key_number for key_number in candidates if self._is_available(self._stats[key_number], model, now)]
+            if len(usable) >= 2 and self._score(self._stats[usable[1]]) > self._score(self._stats[usable[0]]):
+                usable[0], usable[1] = usable[1], usable[0]
+            return usable
+    
+    def wait_time(self, model=None):
+        """Seconds until the first cooling-down key is usable again, or None if every key is ejected"""
+        with self._lock:
+            now = time.monotonic()
+            waits = [max(s["cooldowns"].get(model, 0.0) - now, 0.0) for s in self._stats.values() if not s["ejected"]]
+            return min(waits) if waits else None
+    
+    def record_success(self, key_number, latency):
+        with self._lock:
+            stats = self._stats[key_number]
+            stats["successes"] += 1
+            stats["invalid_streak"] = 0
+            if stats["latency"] is None:
+                stats["latency"] = latency
+            else:
+                stats["latency"] += self.latency_alpha * (latency - stats["latency"])
+    
+    def record_failure(self, key_number):
+        with self._lock:
+            self._stats[key_number]["failures"] += 1
+    
+    def record_rate_limit(self, key_number, retry_after=None, model=None):
+        """Put a throttled key into cooldown for model (for Retry-After seconds when the server sends it)"""
+        with self._lock:
+            stats = self._stats[key_number]
+            stats["failures"] += 1
+            stats["cooldowns"][model] = time.monotonic() + (retry_after if retry_after is not None else self.cooldown)
+    
+    def record_invalid(self, key_number):
+        """Count an invalid-key response; returns True when the key has just been ejected"""
+        with self._lock:
+            stats = self._stats[key_number]
+            stats["failures"] += 1
+            stats["invalid_streak"] += 1
+            if not stats["ejected"] and stats["invalid_streak"] >= self.eject_after:
+                stats["ejected"] = True
+                return True
+            return False
+    
+    def summary(self):
+        """Per-key stats for reporting, ordered by key number"""
+        with self._lock:
+            now = time.monotonic()
+            rows = []
+            for key_number, stats in sorted(self._stats.items()):
+                total = stats["successes"] + stats["failures"]
+                if stats["ejected"]:
+                    state = "ejected"
+                elif any(until > now for until in stats["cooldowns"].values()):
+                    state = "cooldown"
+                else:
+                    state = "healthy"
+                rows.append({
+                    "key_number": key_number,
+                    "state": state,
+                    "requests": total,
+                    "success_rate": stats["successes"] / total if total else None,
+                    "latency": stats["latency"]
+                })
+            return rows
+
+# Per-model quotas per key (free-tier defaults); override with the quotas argument or --rpm/--tpm
+DEFAULT_MODEL_QUOTAS = {
+    "gemini-2.5-pro": {"rpm": 5, "tpm": 250000},
+    "gemini-2.5-flash": {"rpm": 10, "tpm": 250000},
+    "gemini-2.5-flash-lite": {"rpm": 15, "tpm": 250000},
+    "gemini-2.0-flash": {"rpm": 15, "tpm": 1000000},
+    "gemini-2.0-flash-lite": {"rpm": 30, "tpm": 1000000},
+}
+FALLBACK_MODEL_QUOTA = {"rpm": 10, "tpm": 250000}
+
+# Context window and output cap per model, in tokens
+MODEL_TOKEN_LIMITS = {
+    "gemini-2.5-pro": {"input": 1048576, "output": 65536},
+    "gemini-2.5-flash": {"input": 1048576, "output": 65536},
+    "gemini-2.5-flash-lite": {"input": 1048576, "output": 65536},
+    "gemini-2.0-flash": {"input": 1048576, "output": 8192},
+    "gemini-2.0-flash-lite": {"input": 1048576, "output": 8192},
+}
+FALLBACK_MODEL_TOKEN_LIMITS = {"input": 1048576, "output": 8192}
+
+# Payloads estimated above this share of the input limit are measured with countTokens before sending
+PREFLIGHT_COUNT_RATIO = 0.8
+
+def estimate_tokens(text):
+    """Fast local token estimate: about four ASCII characters per token, one per other character"""
+    non_ascii = len(text) - len(text.encode('ascii', 'ignore'))
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+def split_markdown_sections(text, max_tokens, estimate=estimate_tokens, boundary_level=None):
+    """Split markdown into consecutive chunks of at most about max_tokens each
+    
+    Sections start at headings (outside code fences) and are packed into chunks while they fit;
+    a section too large on its own is split at blank lines, then line breaks. With boundary_level
+    (e.g. 2 for # and ##), a top-level section that won't fit in the current chunk as a whole
+    starts a new one instead of being split across two, while small top-level sections still
+    share a chunk. Joining the chunks gives back the original text.
+    """
+    sections = []
+    current = []
+    level = None
+    in_fence = False
+    for line in text.splitlines(keepends=True):
+        heading = None if in_fence else re.match(r'(#{1,6})\s', line)
+        if line.lstrip().startswith(('```', '~~~')):
+            in_fence = not in_fence
+        elif heading:
+            if current:
+                sections.append((''.join(current), level))
+                current = []
+            level = len(heading.group(1))
+        current.append(line)
+    if current:
+        sections.append((''.join(current), level))
+    
+    # Size of the top-level section starting at each boundary heading, up to the next one
+    group_tokens = {}
+    if boundary_level:
+        start = None
+        for i, (section, level) in enumerate(sections):
+            if level and level <= boundary_level:
+                start = i
+                group_tokens[start] = 0
+            if start is not None:
+                group_tokens[start] += estimate(section)
+    
+    chunks = []
+    chunk, chunk_tokens = '', 0
+    for i, (section, level) in enumerate(sections):
+        if chunk and i in group_tokens and chunk_tokens + group_tokens[i] > max_tokens:
+            chunks.append(chunk)
+            chunk, chunk_tokens = '', 0
+        pieces = [section] if estimate(section) <= max_tokens else _split_oversized(section, max_tokens, estimate)
+        for piece in pieces:
+            piece_tokens = estimate(piece)
+            if chunk and chunk_tokens + piece_tokens > max_tokens:
+                chunks.append(chunk)
+                chunk, chunk_tokens = '', 0
+            chunk += piece
+            chunk_tokens += piece_tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def print_progress(label, done, total, detail=""):
+    """Show done/total progress, redrawn on one line when stdout is a terminal"""
+    line = f"[{label}] {done}/{total}" + (f" ({detail})" if detail else "")
+    if sys.stdout.isatty():
+        print(f"\r{line}", end="\n" if done == total else "", flush=True)
+    else:
+        print(line)
+
+def _split_oversized(text, max_tokens, estimate):
+    """Split one oversized section at paragraph, then line, then character boundaries"""
+    for boundary in (r'(?<=\n\n)', r'(?<=\n)'):
+        units = [unit for unit in re.split(boundary, text) if unit]
+        if len(units) > 1:
+            break
+    else:
+        width = max(max_tokens * 4, 1)
+        return [text[i:i + width] for i in range(0, len(text), width)]
+    
+    pieces = []
+    for unit in units:
+        if estimate(unit) > max_tokens:
+            pieces.extend(_split_oversized(unit, max_tokens, estimate))
+        else:
+            pieces.append(unit)
+    return pieces
+
+class TokenBucket:
+    """Classic token bucket refilled continuously up to its capacity"""
+    
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+    
+    def available(self, now):
+        self._refill(now)
+        return self.tokens
+    
+    def time_until(self, amount, now):
+        """Seconds until amount tokens are available"""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing / self.refill_per_second, 0.0)
+    
+    def consume(self, amount):
+        # May go negative when a response used more tokens than estimated; refill pays it back
+        self.tokens -= amount
+
+class QuotaPacer:
+    """Client-side pacing with per-key, per-model token buckets for requests and tokens per minute
+    
+    acquire() dispatches to the candidate key with the most request headroom and blocks while
+    every candidate is saturated, so calls queue locally instead of collecting 403s.
+    """
+    
+    def __init__(self, quotas=None):
+        self.quotas = {model: dict(quota) for model, quota in DEFAULT_MODEL_QUOTAS.items()}
+        for model, quota in (quotas or {}).items():
+            self.quotas.setdefault(model, dict(FALLBACK_MODEL_QUOTA)).update(quota)
+        self._buckets = {}
+        self._cond = threading.Condition()
+    
+    def quota_for(self, model):
+        return self.quotas.get(model, FALLBACK_MODEL_QUOTA)
+    
+    def _buckets_for(self, model, key_number):
+        buckets = self._buckets.get((model, key_number))
+        if buckets is None:
+            quota = self.quota_for(model)
+            buckets = (TokenBucket(quota["rpm"], quota["rpm"] / 60.0),
+                       TokenBucket(quota["tpm"], quota["tpm"] / 60.0))
+            self._buckets[(model, key_number)] = buckets
+        return buckets
+    
+    def _headroom(self, model, key_number, tokens, now):
+        """Whole requests the key can send right now, or 0 if either bucket is short"""
+        requests_bucket, tokens_bucket = self._buckets_for(model, key_number)
+        if tokens_bucket.available(now) < min(tokens, tokens_bucket.capacity):
+            return 0
+        return int(requests_bucket.available(now))
+    
+    def try_acquire(self, model, key_number, tokens):
+        """Take a slot on one specific key without waiting; returns True on success"""
+        with self._cond:
+            if self._headroom(model, key_number, tokens, time.monotonic()) < 1:
+                return False
+            self._consume(model, key_number, tokens)
+            return True
+    
+    def acquire(self, model, candidates, tokens, deadline=None):
+        """Take a slot on the candidate key with the most headroom, waiting while all are saturated
+        
+        candidates is a callable returning usable key numbers in preference order (re-evaluated
+        after every wait); ties keep that order. Returns None once no candidate is usable at all
+        or the monotonic deadline passes.
+        """
+        with self._cond:
+            while True:
+                keys = candidates()
+                if not keys:
+                    return None
+                
+                now = time.monotonic()
+                best_key, best_headroom = None, 0
+                for key_number in keys:
+                    headroom = self._headroom(model, key_number, tokens, now)
+                    if headroom > best_headroom:
+                        best_key, best_headroom = key_number, headroom
+                
+                if best_key is not None:
+                    self._consume(model, key_number=best_key, tokens=tokens)
+                    return best_key
+                
+                if deadline is not None and now >= deadline:
+                    return None
+                
+                wait = min(
+                    max(buckets[0].time_until(1, now), buckets[1].time_until(tokens, now))
+                    for buckets in (self._buckets_for(model, key_number) for key_number in keys)
+                )
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+                self._cond.wait(max(wait, 0.05))
+    
+    def _consume(self, model, key_number, tokens):
+        requests_bucket, tokens_bucket = self._buckets_for(model, key_number)
+        requests_bucket.consume(1)
+        tokens_bucket.consume(tokens)
+    
+    def settle(self, model, key_number, estimated_tokens, actual_tokens):
+        """Correct a key's token bucket once the response reports the real token usage"""
+        with self._cond:
+            self._buckets_for(model, key_number)[1].consume(actual_tokens - estimated_tokens)
+            self._cond.notify_all()
+
+class RetryPolicy:
+    """Bounded retries with exponential backoff and full jitter
+    
+    max_attempts and deadline bound a single call. retry_budget is shared by every call on the
+    client: each retry spends one token and each success earns back budget_refill, so an outage
+    cannot turn into a retry storm. Retry-After is honored per key through the health registry's
+    cooldown, which also makes a call wait when every key is cooling down.
+    """
+    
+    def __init__(self, max_attempts=10, base_delay=1.0, max_delay=30.0, deadline=900.0,
+                 retry_budget=50, budget_refill=0.2):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_budget = retry_budget
+        self.budget_refill = budget_refill
+        self._budget = float(retry_budget)
+        self._lock = threading.Lock()
+    
+    def delay(self, attempt):
+        """Seconds to wait after failed attempt number attempt (1-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+    
+    def spend(self):
+        """Take one retry from the shared budget; False when it is exhausted"""
+        with self._lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+            return True
+    
+    def earn(self):
+        """Credit the shared budget after a successful call"""
+        with self._lock:
+            self._budget = min(float(self.retry_budget), self._budget + self.budget_refill)
+
+class LatencyTracker:
+    """Rolling latency samples per (model, key, prompt-size bucket) used to derive request timeouts
+    
+    A timeout is the p99 of the matching window times safety_factor, clamped to
+    [min_timeout, max_timeout]. Windows with too few samples fall back to the model-wide window
+    for the same size bucket and then to the cold-start default. Samples persist in a small JSON
+    state file so one-shot CLI runs start warm.
+    """
+    
+    # Upper bounds (estimated prompt tokens) of the size buckets; larger prompts share the last one
+    SIZE_BUCKETS = (2000, 8000, 32000, 128000)
+    COLD_START_TIMEOUTS = (60, 90, 120, 180, 240)
+    
+    def __init__(self, path=None, window=200, min_samples=5, percentile=99, safety_factor=2.0,
+                 min_timeout=30, max_timeout=300, escalation=1.5):
+        self.path = path
+        self.window = window
+        self.min_samples = min_samples
+        self.percentile = percentile
+        self.safety_factor = safety_factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.escalation = escalation
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._load()
+    
+    def size_bucket(self, tokens):
+        for bucket, limit in enumerate(self.SIZE_BUCKETS):
+            if tokens <= limit:
+                return bucket
+        return len(self.SIZE_BUCKETS)
+    
+    def record(self, model, key_number, tokens, latency):
+        """Add a successful call's latency to the key's window and the model-wide window"""
+        bucket = self.size_bucket(tokens)
+        with self._lock:
+            for window_key in ((model, key_number, bucket), (model, None, bucket)):
+                samples = self._samples.get(window_key)
+                if samples is None:
+                    samples = self._samples[window_key] = deque(maxlen=self.window)
+                samples.append(latency)
+    
+    def quantile(self, model, key_number, tokens, percentile):
+        """Latency at the given percentile for the best-matching window, or None without enough data"""
+        bucket = self.size_bucket(tokens)
+        with self._lock:
+            for window_key in ((model, key_number, bucket), (model, None, bucket)):
+                samples = self._samples.get(window_key)
+                if samples and len(samples) >= self.min_samples:
+                    ordered = sorted(samples)
+                    return ordered[min(int(len(ordered) * percentile / 100), len(ordered) - 1)]
+        return None
+    
+    def timeout(self, model, key_number, tokens, timeouts_so_far=0):
+        """Timeout in seconds for the next attempt, escalated after attempts that already timed out"""
+        observed = self.quantile(model, key_number, tokens, self.percentile)
+        if observed is None:
+            base = self.COLD_START_TIMEOUTS[self.size_bucket(tokens)]
+        else:
+            base = observed * self.safety_factor
+        base *= self.escalation ** timeouts_so_far
+        return min(max(base, self.min_timeout), self.max_timeout)
+    
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for entry in data:
+                window_key = (entry["model"], entry["key"], entry["bucket"])
+                self._samples[window_key] = deque(entry["samples"], maxlen=self.window)
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            pass
+    
+    def save(self):
+        """Write the windows to the state file (atomically) so the next run starts warm"""
+        if not self.path:
+            return
+        with self._lock:
+            data = [
+                {"model": model, "key": key_number, "bucket": bucket, "samples": list(samples)}
+                for (model, key_number, bucket), samples in self._samples.items()
+            ]
+        try:
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Warning: Could not save latency stats to {self.path}: {e}")
+
+class ResponseCache:
+    """Content-addressed on-disk cache of successful generateContent responses
+    
+    Entries are keyed by a SHA-256 of (model, payload) and stored one JSON file each. A hit
+    touches the file, so mtime tracks last use; evict() drops entries older than max_age and
+    then the least recently used ones until the cache fits in max_bytes.
+    """
+    
+    def __init__(self, directory=".gemini_cache", max_bytes=256 * 1024 * 1024, max_age=30 * 24 * 3600,
+                 refresh=False, evict_every=100):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.refresh = refresh
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+    
+    def key(self, model, payload):
+        canonical = json.dumps({"model": model, "payload": payload}, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+    
+    def get(self, model, payload):
+        """Cached response JSON for (model, payload), or None on a miss (always a miss when refreshing)"""
+        path = self._path(self.key(model, payload))
+        response_json = None
+        if not self.refresh:
+            try:
+                if time.time() - os.path.getmtime(path) <= self.max_age:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        response_json = json.load(f)
+                    os.utime(path)
+            except (OSError, ValueError):
+                response_json = None
+        with self._lock:
+            if response_json is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response_json
+    
+    def put(self, model, payload, response_json):
+        """Store a response atomically; runs eviction every evict_every writes"""
+        path = self._path(self.key(model, payload))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(response_json, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not write response cache entry: {e}")
+            return
+        with self._lock:
+            self.writes += 1
+            due = self.writes % self.evict_every == 0
+        if due:
+            self.evict()
+    
+    def evict(self):
+        """Remove expired entries, then least recently used ones until under max_bytes"""
+        entries = []
+        now = time.time()
+        try:
+            shards = [entry.path for entry in os.scandir(self.directory) if entry.is_dir()]
+        except FileNotFoundError:
+            return
+        for shard in shards:
+            for entry in os.scandir(shard):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.max_age:
+                    self._remove(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+    
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "hit_rate": self.hits / lookups if lookups else None
+            }
+
+class RunJournal:
+    """Append-only JSONL journal of a delegation run, used to resume it without redoing paid calls
+    
+    Events: "run" (task, variants, keys, settings), "draft" (an agent's report text after each
+    completed call that changed it), "score" (an iteration's assessment) and "agent" (an agent's
+    final result). Each event is flushed and fsynced before the run moves on; a torn last line
+    from a crash is ignored on load.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.run_id = os.path.splitext(os.path.basename(path))[0]
+        self._lock = threading.Lock()
+        self._tail_checked = False
+    
+    @classmethod
+    def create(cls, directory):
+        os.makedirs(directory, exist_ok=True)
+        run_id = f"{datetime.now():%Y%m%d-%H%M%S}-{os.urandom(2).hex()}"
+        return cls(os.path.join(directory, f"{run_id}.jsonl"))
+    
+    def record(self, event, **fields):
+        line = json.dumps(dict(fields, event=event, time=datetime.now().isoformat(timespec='seconds')))
+        with self._lock:
+            if not self._tail_checked:
+                # Start on a fresh line after a torn write from a crashed run
+                self._tail_checked = True
+                if os.path.exists(self.path) and os.path.getsize(self.path):
+                    with open(self.path, 'rb') as f:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            line = "\n" + line
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+    
+    def replay(self):
+        """Return (run event, {agent number: state}) from the journal
+        
+        An agent's state holds its latest "draft", its "scores" by iteration and, once it has
+        finished, its "result".
+        """
+        run = None
+        agents = {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event["event"] == "run":
+                    run = event
+                    continue
+                state = agents.setdefault(event.get("agent"), {"draft": None, "scores": {}, "result": None})
+                if event["event"] == "draft":
+                    state["draft"] = event
+                elif event["event"] == "score":
+                    state["scores"][event["iteration"]] = event["quality"]
+                elif event["event"] == "agent":
+                    state["result"] = event["result"]
+        if run is None:
+            raise ValueError(f"{self.path} is not a run journal")
+        return run, agents
+
+# Words dropped when deriving a prompt's topic (report filenames and near-duplicate matching)
+TOPIC_STOP_WORDS = {
+    'research', 'analyze', 'study', 'investigate', 'examine', 'explore',
+    'the', 'and', 'or', 'in', 'on', 'about', 'for', 'with', 'by', 'from',
+    'a', 'an', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
+    'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
+    'should', 'may', 'might', 'can', 'must', 'shall', 'why', 'how', 'what'
+}
+
+def topic_words(text):
+    """Lower-cased content words of a prompt, in order, without stop words or words under 3 characters"""
+    return [
+        word.lower().strip('.,!?;:()[]{}"\'-')
+        for word in text.split()
+        if word.lower().strip('.,!?;:()[]{}"\'-') not in TOPIC_STOP_WORDS and len(word) > 2
+    ]
+
+class NearDuplicateIndex:
+    """Persistent MinHash/LSH index of the prompts behind past reports, for spotting reworded repeats
+    
+    A prompt is reduced to its set of topic words (light plural folding, so word order and
+    filler don't matter) and summarised by a num_perm-value MinHash signature, whose agreement
+    rate estimates the Jaccard similarity of two sets. Signatures are cut into bands and
+    bucketed, so a lookup only scores reports sharing at least one band with the prompt; bands
+    are sized to catch pairs well below the threshold, which the estimate then enforces.
+    
+    Entries are appended to a JSONL file as reports are written (the latest line per report path
+    wins, "removed" lines drop one) and the file is rewritten once most of it is superseded.
+    """
+    
+    PRIME = (1 << 61) - 1
+    
+    def __init__(self, path=".gemini_dedup.jsonl", threshold=0.7, num_perm=128):
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = self._band_layout(num_perm, threshold)
+        rng = random.Random(num_perm)
+        self._permutations = [(rng.randrange(1, self.PRIME), rng.randrange(self.PRIME)) for _ in range(num_perm)]
+        self.entries = {}
+        self._buckets = {}
+        self._lines = 0
+        self.lookups = 0
+        self.matches = 0
+        self._lock = threading.Lock()
+        self._load()
+    
+    @staticmethod
+    def _band_layout(num_perm, threshold):
+        """(bands, rows) with the largest rows whose LSH inflection point (1/b)^(1/r) stays under threshold"""
+        layout = (num_perm, 1)
+        for rows in range(1, num_perm + 1):
+            bands = num_perm // rows
+            if num_perm % rows == 0 and (1 / bands) ** (1 / rows) <= threshold:
+                layout = (bands, rows)
+        return layout
+    
+    @staticmethod
+    def shingles(text):
+        return {word[:-1] if len(word) > 4 and word.endswith('s') and not word.endswith('ss') else word
+                for word in topic_words(text) if word}
+    
+    def signature(self, text):
+        """MinHash signature of a prompt's topic words, or None when it has none"""
+        hashes = [int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'big')
+                  for word in self.shingles(text)]
+        if not hashes:
+            return None
+        return [min((a * h + b) % self.PRIME for h in hashes) for a, b in self._permutations]
+    
+    def _band_keys(self, signature):
+        return [(band, tuple(signature[band * self.rows:(band + 1) * self.rows])) for band in range(self.bands)]
+    
+    def similarity(self, first, second):
+        return sum(1 for x, y in zip(first, second) if x == y) / self.num_perm
+    
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._lines += 1
+                    if entry.get("removed"):
+                        self._unlink(entry["path"])
+                    elif len(entry.get("signature") or ()) == self.num_perm:
+                        self._link(entry)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Warning: Could not load near-duplicate index from {self.path}: {e}")
+    
+    def _link(self, entry):
+        self._unlink(entry["path"])
+        self.entries[entry["path"]] = entry
+        for band_key in self._band_keys(entry["signature"]):
+            self._buckets.setdefault(band_key, set()).add(entry["path"])
+    
+    def _unlink(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is None:
+            return
+        for band_key in self._band_keys(entry["signature"]):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(path)
+                if not bucket:
+                    del self._buckets[band_key]
+    
+    def _append(self, record):
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + "\n")
+            self._lines += 1
+        except OSError as e:
+            print(f"Warning: Could not update near-duplicate index {self.path}: {e}")
+            return
+        if self._lines > 64 and self._lines > 2 * len(self.entries):
+            self._compact()
+    
+    def _compact(self):
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(temp_path, self.path)
+            self._lines = len(self.entries)
+        except OSError as e:
+            print(f"Warning: Could not compact near-duplicate index {self.path}: {e}")
+    
+    def add(self, kind, prompt, path):
+        """Index (or re-index) the report at path as the answer to prompt"""
+        signature = self.signature(prompt)
+        with self._lock:
+            if signature is None:
+                if path in self.entries:
+                    self._unlink(path)
+                    self._append({"path": path, "removed": True})
+                return
+            entry = {"path": path, "kind": kind, "prompt": prompt, "signature": signature,
+                     "time": datetime.now().isoformat(timespec='seconds')}
+            self._link(entry)
+            self._append(entry)
+    
+    def discard(self, path):
+        with self._lock:
+            if path in self.entries:
+                self._unlink(path)
+                self._append({"path": path, "removed": True})
+    
+    def find(self, prompt, kind=None, limit=3):
+        """[(similarity, entry)] for indexed reports at or above the threshold, most similar first"""
+        signature = self.signature(prompt)
+        matches = []
+        with self._lock:
+            self.lookups += 1
+            if signature is not None:
+                candidates = set()
+                for band_key in self._band_keys(signature):
+                    candidates |= self._buckets.get(band_key, set())
+                for path in candidates:
+                    entry = self.entries[path]
+                    if kind is not None and entry["kind"] != kind:
+                        continue
+                    score = self.similarity(signature, entry["signature"])
+                    if score >= self.threshold:
+                        matches.append((score, entry))
+            if matches:
+                self.matches += 1
+        matches.sort(key=lambda match: (match[0], match[1]["time"]), reverse=True)
+        return matches[:limit]
+
+class SQLiteReportStore:
+    """Report store backed by SQLite, with FTS5 full-text search over prompts and report text
+    
+    Every report the client writes becomes a row holding its Markdown exactly as written plus
+    agent, key, model, score, iteration and timestamps, so reports whose filenames collide
+    stay separate and listing or searching never touches the output directory. Revisions and
+    scores update the newest row for a report path. A client takes any object with the same
+    add/update/discard methods as its report_store.
+    """
+    
+    COLUMNS = ("id", "kind", "prompt", "path", "agent", "key_number", "model", "score", "iteration",
+               "created", "updated")
+    
+    def __init__(self, path=".gemini_reports.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS reports (
+                id INTEGER PRIMARY KEY, kind TEXT NOT NULL, prompt TEXT NOT NULL, path TEXT NOT NULL,
+                agent INTEGER, key_number INTEGER, model TEXT, score REAL, iteration INTEGER,
+                created TEXT NOT NULL, updated TEXT NOT NULL, markdown TEXT NOT NULL)""")
+            for column in ("path", "created", "agent", "score"):
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS reports_{column} ON reports ({column})")
+            self.full_text = self._create_fts()
+    
+    def _create_fts(self):
+        """Create the FTS5 index and its sync triggers; False when SQLite lacks FTS5"""
+        try:
+            self._conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts
+                USING fts5(prompt, markdown, content='reports', content_rowid='id')""")
+        except sqlite3.OperationalError:
+            print("Warning: SQLite was built without FTS5, report search falls back to substring matching")
+            return False
+        self._conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS reports_ai AFTER INSERT ON reports BEGIN
+                INSERT INTO reports_fts (rowid, prompt, markdown) VALUES (new.id, new.prompt, new.markdown);
+            END;
+            CREATE TRIGGER IF NOT EXISTS reports_ad AFTER DELETE ON reports BEGIN
+                INSERT INTO reports_fts (reports_fts, rowid, prompt, markdown)
+                VALUES ('delete', old.id, old.prompt, old.markdown);
+            END;
+            CREATE TRIGGER IF NOT EXISTS reports_au AFTER UPDATE OF prompt, markdown ON reports BEGIN
+                INSERT INTO reports_fts (reports_fts, rowid, prompt, markdown)
+                VALUES ('delete', old.id, old.prompt, old.markdown);
+                INSERT INTO reports_fts (rowid, prompt, markdown) VALUES (new.id, new.prompt, new.markdown);
+            END;
+        """)
+        return True
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    def add(self, kind, prompt, path, markdown, agent=None, key_number=None, model=None, iteration=1):
+        """Insert a newly written report and return its id"""
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """INSERT INTO reports (kind, prompt, path, agent, key_number, model, iteration, created, updated,
+                                        markdown) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (kind, prompt, path, agent, key_number, model, iteration, now, now, markdown))
+            return cursor.lastrowid
+    
+    def update(self, path, **fields):
+        """Update the newest report at path; new markdown clears its score. False if there is none"""
+        if "markdown" in fields:
+            fields.setdefault("score", None)
+        fields["updated"] = datetime.now().isoformat(timespec='seconds')
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"UPDATE reports SET {assignments} WHERE id = (SELECT MAX(id) FROM reports WHERE path = ?)",
+                (*fields.values(), path))
+            return cursor.rowcount > 0
+    
+    def discard(self, path):
+        """Delete the newest report at path (its file was thrown away)"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM reports WHERE id = (SELECT MAX(id) FROM reports WHERE path = ?)", (path,))
+    
+    def _filters(self, kind, agent):
+        clauses, params = [], []
+        if kind:
+            clauses.append("r.kind = ?")
+            params.append(kind)
+        if agent is not None:
+            clauses.append("r.agent = ?")
+            params.append(agent)
+        return clauses, params
+    
+    def list(self, kind=None, agent=None, limit=20):
+        """Newest reports first, without their Markdown"""
+        clauses, params = self._filters(kind, agent)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        columns = ", ".join(f"r.{column}" for column in self.COLUMNS)
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {columns} FROM reports r {where} ORDER BY r.id DESC LIMIT ?",
+                                      (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+    
+    def search(self, query, kind=None, agent=None, limit=20):
+        """Best matches for query (every word must appear) with a text snippet, best first"""
+        if not query.split():
+            raise ValueError("Search query is empty")
+        clauses, params = self._filters(kind, agent)
+        columns = ", ".join(f"r.{column}" for column in self.COLUMNS)
+        if self.full_text:
+            # Quote each word so punctuation in user input can't be read as FTS5 query syntax
+            match = " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+            sql = f"""SELECT {columns}, snippet(reports_fts, 1, '[', ']', '...', 12) AS snippet
+                      FROM reports_fts JOIN reports r ON r.id = reports_fts.rowid
+                      WHERE reports_fts MATCH ? {''.join(' AND ' + clause for clause in clauses)}
+                      ORDER BY bm25(reports_fts) LIMIT ?"""
+            params = [match, *params]
+        else:
+            for word in query.split():
+                clauses.append("(r.prompt LIKE ? OR r.markdown LIKE ?)")
+                params.extend([f"%{word}%"] * 2)
+            where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+            sql = f"SELECT {columns}, substr(r.prompt, 1, 80) AS snippet FROM reports r {where} ORDER BY r.id DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+    
+    def get(self, report_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM reports WHERE id = ?", (report_id,)).fetchone()
+        return dict(row) if row else None
+    
+    def export(self, report_ids, output_dir):
+        """Write reports as Markdown files under their original names; returns the paths written
+        
+        Reports exported together that share a name get their id appended instead of overwriting.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        written = []
+        names = set()
+        for report_id in report_ids:
+            report = self.get(report_id)
+            if report is None:
+                raise ValueError(f"No report with id {report_id}")
+            name = os.path.basename(report["path"])
+            if name in names:
+                stem, extension = os.path.splitext(name)
+                name = f"{stem}_{report_id}{extension}"
+            names.add(name)
+            filepath = os.path.join(output_dir, name)
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write(report["markdown"])
+            written.append(filepath)
+        return written
+
+# Smallest prefix (in tokens) each model accepts for explicit context caching
+CONTEXT_CACHE_MIN_TOKENS = {
+    "gemini-2.5-pro": 4096,
+    "gemini-2.5-flash": 1024,
+    "gemini-2.5-flash-lite": 1024,
+}
+FALLBACK_CONTEXT_CACHE_MIN_TOKENS = 4096
+
+class ContextCache:
+    """Registry of explicit Gemini context caches (cachedContents) created by this client
+    
+    Cached contents belong to the project of the key that created them, so entries are keyed by
+    (model, key number, prefix hash). An entry is reused until renew_margin seconds before its
+    TTL runs out; concurrent callers for the same entry wait for a single create, and a failed
+    create is remembered for a while so the prefix is just sent inline. The client deletes every
+    live entry when it closes.
+    """
+    
+    def __init__(self, ttl=600, min_tokens=None, renew_margin=30, retry_after=60):
+        self.ttl = ttl
+        self.min_tokens = dict(CONTEXT_CACHE_MIN_TOKENS, **(min_tokens or {}))
+        self.renew_margin = renew_margin
+        self.retry_after = retry_after
+        self.created = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._creating = {}
+    
+    @staticmethod
+    def digest(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+    
+    def eligible(self, model, tokens):
+        """True if a prefix of this many tokens is large enough to cache for model"""
+        return tokens >= self.min_tokens.get(model, FALLBACK_CONTEXT_CACHE_MIN_TOKENS)
+    
+    def preferred_key(self, model, digest):
+        """A key number that already holds a live cache for this prefix, or None"""
+        now = time.monotonic()
+        with self._lock:
+            for (entry_model, key_number, entry_digest), entry in self._entries.items():
+                if (entry_model == model and entry_digest == digest and entry["name"]
+                        and entry["expires"] - now > self.renew_margin):
+                    return key_number
+        return None
+    
+    def get_or_create(self, model, key_number, digest, create=None):
+        """Return the cache name for this prefix on key_number, calling create() if there is none
+        
+        Without create, only a live cache (or one being created) is used. Returns None when the
+        prefix should be sent inline.
+        """
+        entry_key = (model, key_number, digest)
+        while True:
+            with self._lock:
+                entry = self._entries.get(entry_key)
+                if entry and entry["expires"] - time.monotonic() > self.renew_margin:
+                    if entry["name"]:
+                        self.hits += 1
+                    return entry["name"]
+                pending = self._creating.get(entry_key)
+                if pending is None:
+                    if create is None:
+                        return None
+                    pending = self._creating[entry_key] = threading.Event()
+                    break
+            pending.wait()
+        
+        name = None
+        started = time.monotonic()
+        try:
+            name = create()
+        finally:
+            with self._lock:
+                if name:
+                    self.created += 1
+                    self._entries[entry_key] = {"name": name, "expires": started + self.ttl}
+                else:
+                    self._entries[entry_key] = {"name": None, "expires": time.monotonic() + self.renew_margin
+                                                + self.retry_after}
+                del self._creating[entry_key]
+            pending.set()
+        return name
+    
+    def invalidate(self, model, key_number, digest):
+        """Forget an entry the server no longer recognizes"""
+        with self._lock:
+            self._entries.pop((model, key_number, digest), None)
+    
+    def drain(self):
+        """Remove and return (key_number, name) for every entry that may still be live"""
+        now = time.monotonic()
+        with self._lock:
+            live = [(key_number, entry["name"]) for (_, key_number, _), entry in self._entries.items()
+                    if entry["name"] and entry["expires"] > now]
+            self._entries.clear()
+        return live
+
+REPORT_FORMATS = {
+    "research": {
+        "name": "Research report",
+        "title": "Research Report",
+        "label": "Topic",
+        "section": "Research Findings",
+        "footer": "Report generated by Enhanced Gemini Client",
+        "suffix": "RESEARCH"
+    },
+    "task": {
+        "name": "Task report",
+        "title": "Task Completion Report",
+        "label": "Task",
+        "section": "Task Results",
+        "footer": "Task completed by Enhanced Gemini Client",
+        "suffix": "TASK"
+    }
+}
+
+# Response schemas for JSON-mode quality assessment
+ASSESSMENT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "score": {"type": "NUMBER", "description": "Overall quality score from 1 to 10"},
+        "explanation": {"type": "STRING", "description": "Brief explanation of the score"},
+        "improvements": {"type": "STRING", "description": "Specific improvements needed, or None if score >= 7"}
+    },
+    "required": ["score", "explanation", "improvements"],
+    "propertyOrdering": ["score", "explanation", "improvements"]
+}
+CRITIQUE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": dict(ASSESSMENT_SCHEMA["properties"], revised_report={
+        "type": "STRING",
+        "description": "Complete revised result in markdown if score < 7, otherwise an empty string"
+    }),
+    "required": ["score", "explanation", "improvements", "revised_report"],
+    "propertyOrdering": ["score", "explanation", "improvements", "revised_report"]
+}
+
+# Pipelined mode improves the first draft before any assessment exists, so it gets general guidance
+SPECULATIVE_IMPROVEMENT_POINTS = """General review: fix any errors or gaps, add missing detail and concrete examples,
+strengthen the analysis and make the structure and conclusions clearer."""
+
+class CancelToken:
+    """Cooperative cancellation shared by a group of calls (race mode)
+    
+    Requests check it before each attempt and during backoff; streaming responses registered
+    with track() are closed as soon as it is cancelled, which aborts their connections.
+    """
+    
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._responses = set()
+        self.winner = None
+    
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+    
+    def claim(self, winner):
+        """Cancel everyone else on behalf of winner; returns False if someone else already won"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.winner = winner
+            self._event.set()
+            responses = list(self._responses)
+            self._responses.clear()
+        for response in responses:
+            response.close()
+        return True
+    
+    def wait(self, timeout):
+        """Sleep for up to timeout seconds; returns True if cancelled meanwhile"""
+        return self._event.wait(timeout)
+    
+    def track(self, response):
+        """Register an open streaming response; it is closed right away if already cancelled"""
+        with self._lock:
+            if not self._event.is_set():
+                self._responses.add(response)
+                return
+        response.close()
+    
+    def untrack(self, response):
+        with self._lock:
+            self._responses.discard(response)
+
+class StreamingReportWriter:
+    """Writes a report incrementally into a temp file and renames it into place on commit
+    
+    The header goes out immediately, streamed text is appended (and optionally echoed to
+    stdout) as it arrives, and reset() rewinds to just after the header when a call is retried.
+    """
+    
+    def __init__(self, output_dir, header, footer, echo=False):
+        self.footer = footer
+        self.echo = echo
+        fd, self.temp_path = tempfile.mkstemp(prefix=".report_", suffix=".partial", dir=output_dir)
+        self._file = os.fdopen(fd, 'w', encoding='utf-8')
+        self._file.write(header)
+        self._file.flush()
+        self._body_start = self._file.tell()
+        self._written = False
+    
+    def write(self, text):
+        self._file.write(text)
+        self._file.flush()
+        self._written = True
+        if self.echo:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+    
+    def reset(self):
+        """Drop any partial body from a failed attempt"""
+        if not self._written:
+            return
+        self._file.seek(self._body_start)
+        self._file.truncate()
+        self._written = False
+        if self.echo:
+            print("\n[STREAM] Retrying, discarding partial output...")
+    
+    def commit(self, filepath):
+        """Finish the report and atomically move it to filepath"""
+        self._file.write(self.footer)
+        self._file.close()
+        os.replace(self.temp_path, filepath)
+        if self.echo:
+            print()
+    
+    def abort(self):
+        """Discard the partial report"""
+        self._file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+
 class EnhancedGeminiClient:
     """Enhanced Gemini client for research and general task delegation"""
     
-    def __init__(self, model="gemini-2.5-pro", timeout=30, specific_key=None):
+    def __init__(self, model="gemini-2.5-pro", timeout=30, specific_key=None, concurrency=8,
+                 assessment_model=None, improvement_model=None,
+                 key_cooldown=60, eject_after=3, quotas=None, pacing=True, retry_policy=None,
+                 timeout_factor=2.0, max_timeout=300, hedge=False, max_hedge_ratio=0.1,
+                 cache=True, refresh_cache=False, stream=False, echo=False, stream_stall_timeout=30,
+                 quality_mode="separate", race=False, context_cache=False, context_ttl=600, chunk_tokens=None,
+                 dedup=None, dedup_threshold=0.7, report_store=None):
+        # Per-role model routing: generation writes reports, assessment grades them, improvement revises them
         self.model = model
-        self.base_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+        self.assessment_model = assessment_model or model
+        self.improvement_model = improvement_model or model
+        self.api_base = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com/v1beta').rstrip('/')
         self.timeout = timeout
         self.api_keys = self._load_api_keys()
-        self.last_created_file = None
-        self.specific_key = specific_key
-        self.last_used_key_number = None
         
         if not self.api_keys:
             raise ValueError("No API keys found! Please check your .env file.")
         
+        self.last_created_file = None
+        self.runs_dir = os.getenv('GEMINI_RUNS_DIR', '.gemini_runs')
+        self.specific_key = specific_key
+        self.concurrency = max(1, concurrency)
+        # Client-wide cap on API attempts in flight; batch jobs, agents, map chunks and section
+        # improvements nest their own worker pools, so the cap lives here rather than in any pool
+        self._request_slots = threading.BoundedSemaphore(self.concurrency)
+        self.key_counter = self._create_key_counter()
+        self.key_health = KeyHealthRegistry(len(self.api_keys), key_cooldown, eject_after)
+        self.pacer = QuotaPacer(quotas) if pacing else None
+        self.retry_policy = retry_policy or RetryPolicy()
+        # timeout is the floor for adaptive timeouts derived from observed latency
+        self.latency = LatencyTracker(os.getenv('GEMINI_LATENCY_FILE', '.gemini_latency.json'),
+                                      safety_factor=timeout_factor, min_timeout=timeout,
+                                      max_timeout=max(max_timeout, timeout))
+        self.hedge = hedge
+        self.max_hedge_ratio = max_hedge_ratio
+        self._hedge_lock = threading.Lock()
+        self._hedge_stats = {"calls": 0, "hedges": 0, "wins": 0}
+        self._hedge_executor = (ThreadPoolExecutor(max_workers=self.concurrency * 2, thread_name_prefix="hedge")
+                                if hedge else None)
+        self.cache = (ResponseCache(os.getenv('GEMINI_CACHE_DIR', '.gemini_cache'), refresh=refresh_cache)
+                      if cache else None)
+        # Near-duplicate prompt detection: "warn" lists similar past reports, "reuse" returns one
+        # instead of researching again (the exact-match response cache can't catch rewordings)
+        self.dedup = dedup
+        self.dedup_index = (NearDuplicateIndex(os.getenv('GEMINI_DEDUP_FILE', '.gemini_dedup.jsonl'),
+                                               threshold=dedup_threshold)
+                            if dedup else None)
+        self._dedup_scanned = set()
+        self._dedup_lock = threading.Lock()
+        # Optional queryable copy of every report written (see SQLiteReportStore)
+        self.report_store = report_store
+        # Explicit server-side caching of large prompt prefixes (see _make_request's context). The
+        # cached prefix is a report context shared by the assessment and improvement calls, and
+        # caches are per model, so with different models for those roles each upload would serve
+        # one call and only add a create and a delete to it
+        self.context_cache = (ContextCache(ttl=context_ttl)
+                              if context_cache and self.assessment_model == self.improvement_model else None)
+        # Reports larger than this are improved section by section; the default leaves the
+        # improvement model room to grow each part within its output cap
+        self.chunk_tokens = chunk_tokens or self._token_limits(self.improvement_model)["output"] // 2
+        # "separate": assess then improve (two calls per iteration); "combined": one critique-and-revise call;
+        # "pipelined": improve speculatively while the assessment runs, keeping the draft only if it scores low
+        self.quality_mode = quality_mode
+        self._speculation_lock = threading.Lock()
+        self._speculation_stats = {"started": 0, "kept": 0, "discarded": 0}
+        self._speculation_executor = (ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="speculate")
+                                      if quality_mode == "pipelined" else None)
+        # Race mode stops every agent once one reaches the quality threshold; the agent thread's
+        # cancel token lives in _local, and non-streamed calls run on _race_executor so they can be abandoned
+        self.race = race
+        self._local = threading.local()
+        self._race_executor = (ThreadPoolExecutor(max_workers=self.concurrency * 2, thread_name_prefix="race")
+                               if race else None)
+        self.stream = stream
+        self.echo = echo
+        self.stream_stall_timeout = stream_stall_timeout
+        self.session = self._create_session()
+        
         print(f"Loaded {len(self.api_keys)} API keys")
         if specific_key:
             print(f"Using specific key: {specific_key}")
+        if self.assessment_model != model or self.improvement_model != model:
+            print(f"Models: generation={model}, assessment={self.assessment_model}, "
+                  f"improvement={self.improvement_model}")
+        if context_cache and self.context_cache is None:
+            print("[CONTEXT CACHE] Disabled: assessment and improvement use different models, so no cached "
+                  "prefix would be reused")
+    
+    def _model_url(self, model, method="generateContent"):
+        """REST endpoint for a model method"""
+        return f"{self.api_base}/models/{model}:{method}"
+    
+    def _create_session(self):
+        """Create a keep-alive HTTP session whose connection pool matches the concurrency cap"""
+        session = requests.Session()
+        # Retries are handled by _make_request, so the adapter itself never retries;
+        # hedging can put two requests in flight per concurrent call. Requests outside the
+        # _request_slots cap (cache creates, abandoned race calls) wait for a free connection
+        # instead of opening throwaway ones
+        pool_size = self.concurrency * (2 if self.hedge else 1)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({'Content-Type': 'application/json'})
+        return session
+    
+    def close(self):
+        """Close pooled HTTP connections, save latency stats and release the key rotation state"""
+        if self._hedge_executor:
+            self._hedge_executor.shutdown(wait=False, cancel_futures=True)
+        if self._speculation_executor:
+            self._speculation_executor.shutdown(wait=False, cancel_futures=True)
+        if self._race_executor:
+            self._race_executor.shutdown(wait=False, cancel_futures=True)
+        if self.cache and self.cache.writes:
+            self.cache.evict()
+        if self.context_cache:
+            self._release_context_caches()
+        self.session.close()
+        self.latency.save()
+        self.key_counter.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _create_key_counter(self):
+        """Create the rotation counter, seeded from a legacy GEMINI_KEY_INDEX if one is set"""
+        try:
+            initial = max(int(os.getenv('GEMINI_KEY_INDEX', '1')) - 1, 0)
+        except ValueError:
+            initial = 0
+        state_file = os.getenv('GEMINI_KEY_STATE_FILE', '.gemini_key_state')
+        return KeyRotationCounter(state_file, initial)
     
     def _load_api_keys(self):
         """Load all API keys from environment variables"""
@@ -49,81 +1467,64 @@ class EnhancedGeminiClient:
                 break
         return keys
     
-    def _get_next_key(self):
-        """Get the next API key using specific key or round-robin with .env file counter"""
-        if self.specific_key:
-            # Use specific key without updating counter
-            array_index = (self.specific_key - 1) % len(self.api_keys)
-            self.last_used_key_number = self.specific_key
-            return self.api_keys[array_index]
-        
-        # Load current counter from .env file (1-based)
-        current_key_number = self._load_key_index()
+    def _get_next_key(self, specific_key=None, tokens=0, deadline=None, exclude=None, model=None):
+        """Get the next API key as (key, key_number) using a pinned key or the shared rotation counter
         
-        # Convert to 0-based index for array access
-        array_index = (current_key_number - 1) % len(self.api_keys)
-        
-        # Get the key at current index
-        selected_key = self.api_keys[array_index]
-        
-        # Store the key number that was actually used
-        self.last_used_key_number = current_key_number
+        Keys that are cooling down or ejected are skipped. With pacing on, rotation goes to the
+        usable key with the most quota headroom and waits while every key is saturated; a
+        saturated pinned key falls back to rotation. Returns (None, None) if no key is usable
+        (or, with pacing, none frees up before the monotonic deadline). exclude skips one key number.
+        Health and quota are checked for model (default: the generation model).
+        """
+        model = model or self.model
+        if specific_key:
+            specific_key = ((specific_key - 1) % len(self.api_keys)) + 1
+        if (specific_key and self.key_health.is_available(specific_key, model)
+                and (self.pacer is None or self.pacer.try_acquire(model, specific_key, tokens))):
+            # Use pinned key without updating counter
+            return self.api_keys[specific_key - 1], specific_key
         
-        # Increment counter for next use (stay in 1-based numbering)
-        # Fix: Properly handle 1-20 cycling
-        if current_key_number >= len(self.api_keys):
-            next_key_number = 1
+        # Reserve the next rotation position (1-based key numbers cycle through 1..len(api_keys))
+        start = self.key_counter.next()
+        rotation = [((start + i) % len(self.api_keys)) + 1 for i in range(len(self.api_keys))]
+        if exclude:
+            rotation.remove(exclude)
+        if self.pacer is None:
+            usable = self.key_health.rank(rotation, model)
+            current_key_number = usable[0] if usable else None
         else:
-            next_key_number = current_key_number + 1
-        self._save_key_index(next_key_number)
+            current_key_number = self.pacer.acquire(model, lambda: self.key_health.rank(rotation, model), tokens,
+                                                    deadline)
+        if current_key_number is None:
+            return None, None
         
-        return selected_key
+        return self.api_keys[current_key_number - 1], current_key_number
     
-    def _load_key_index(self):
-        """Load the key index from .env file (1-based numbering)"""
-        try:
-            with open('.env', 'r') as f:
-                lines = f.readlines()
-            
-            for line in lines:
-                if line.strip().startswith('GEMINI_KEY_INDEX='):
-                    return int(line.strip().split('=')[1])
-            
-            # If not found, return 1 (first key)
-            return 1
-        except (FileNotFoundError, ValueError, IndexError):
-            return 1
+    def _estimate_tokens(self, text):
+        """Fast local token count for pacing and pre-flight checks (see estimate_tokens)"""
+        return estimate_tokens(text)
+    
+    def _token_limits(self, model):
+        return MODEL_TOKEN_LIMITS.get(model, FALLBACK_MODEL_TOKEN_LIMITS)
     
-    def _save_key_index(self, index):
-        """Save the key index to .env file"""
+    def _count_tokens(self, model, payload):
+        """Exact prompt size from the countTokens endpoint, or None if it could not be measured"""
+        usable = self.key_health.rank(list(range(1, len(self.api_keys) + 1)), model)
+        if not usable:
+            return None
+        api_key = self.api_keys[usable[0] - 1]
         try:
-            # Read existing .env file
-            try:
-                with open('.env', 'r') as f:
-                    lines = f.readlines()
-            except FileNotFoundError:
-                lines = []
-            
-            # Update or add the GEMINI_KEY_INDEX line
-            updated = False
-            for i, line in enumerate(lines):
-                if line.strip().startswith('GEMINI_KEY_INDEX='):
-                    lines[i] = f'GEMINI_KEY_INDEX={index}\n'
-                    updated = True
-                    break
-            
-            # If not found, add it
-            if not updated:
-                lines.append(f'GEMINI_KEY_INDEX={index}\n')
-            
-            # Write back to .env file
-            with open('.env', 'w') as f:
-                f.writelines(lines)
-                
-        except Exception as e:
-            print(f"Warning: Could not save key index to .env file: {e}")
-            # Fall back to runtime environment variable
-            os.environ['GEMINI_KEY_INDEX'] = str(index)
+            response = self.session.post(f"{self._model_url(model, 'countTokens')}?key={api_key}",
+                                         json={"contents": payload["contents"]}, timeout=self.timeout)
+            if response.status_code == 200:
+                return response.json().get("totalTokens")
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        return None
+    
+    def _current_key_number(self):
+        """Key number the rotation will hand out next (1-based)"""
+        return (self.key_counter.peek() % len(self.api_keys)) + 1
     
     def _sanitize_filename(self, text, max_length=50):
         """Create a safe filename from text"""
@@ -145,92 +1546,467 @@ class EnhancedGeminiClient:
     
     def _extract_topic_keywords(self, prompt, max_words=3):
         """Extract key topic words from prompt for filename"""
-        stop_words = {
-            'research', 'analyze', 'study', 'investigate', 'examine', 'explore',
-            'the', 'and', 'or', 'in', 'on', 'about', 'for', 'with', 'by', 'from',
-            'a', 'an', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
-            'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
-            'should', 'may', 'might', 'can', 'must', 'shall', 'why', 'how', 'what'
+        return '_'.join(topic_words(prompt)[:max_words])
+    
+    def _make_request(self, prompt, key_number=None, sink=None, generation_config=None, model=None, context=None,
+                      cache_context="reuse"):
+        """Make a request to Gemini API with balanced key selection and bounded retries
+        
+        key_number pins the first attempt to that key; later attempts fall back to rotation.
+        With a sink (see StreamingReportWriter) the call uses the streaming endpoint and feeds
+        text chunks to the sink as they arrive. generation_config is sent as generationConfig.
+        model overrides the generation model for this call (see the per-role models).
+        In race mode the call stops as soon as the agent's cancel token fires, returning
+        {"success": False, "cancelled": True, ...}.
+        context is a stable prefix sent ahead of prompt. With context caching on and a large enough
+        prefix, cache_context="create" stores it as cachedContent on the answering key and only
+        prompt is sent; "reuse" only references a cache that already exists, so a prefix that a
+        single call reads is never uploaded. An unpinned call prefers a key that already holds it.
+        Gives up after retry_policy.max_attempts attempts, past the per-call deadline or once the
+        client-wide retry budget is spent, returning {"success": False, "error": ...}.
+        """
+        model = model or self.model
+        policy = self.retry_policy
+        call_started = time.monotonic()
+        deadline = call_started + policy.deadline
+        full_prompt = context + prompt if context else prompt
+        estimated_tokens = self._estimate_tokens(full_prompt)
+        
+        # Prepare payload
+        payload = {
+            "contents": [{
+                "parts": [{"text": full_prompt}]
+            }]
         }
+        if generation_config:
+            payload["generationConfig"] = generation_config
         
-        words = [
-            word.lower().strip('.,!?;:()[]{}"\'-') 
-            for word in prompt.split() 
-            if word.lower().strip('.,!?;:()[]{}"\'-') not in stop_words and len(word) > 2
-        ]
+        if self.cache:
+            cached = self.cache.get(model, payload)
+            if cached is not None:
+                if sink:
+                    sink.reset()
+                    sink.write(self._extract_response_text(cached))
+                return {
+                    "success": True,
+                    "response": cached,
+                    "api_key_used": "response cache",
+                    "key_number": None,
+                    "attempt": 0,
+                    "cached": True
+                }
         
-        return '_'.join(words[:max_words])
-    
-    def _make_request(self, prompt):
-        """Make a request to Gemini API with balanced key selection and retry logic"""
+        context_digest = None
+        if (context and self.context_cache
+                and self.context_cache.eligible(model, self._estimate_tokens(context))):
+            context_digest = self.context_cache.digest(context)
+            if key_number is None:
+                key_number = self.context_cache.preferred_key(model, context_digest)
         
         attempt = 0
-        used_specific_key = False
+        timeouts = 0
+        last_error = None
+        cancel = getattr(self._local, "cancel", None)
         
-        while True:  # Keep trying until success!
-            try:
-                # Get next key in balanced rotation or specific key
-                if self.specific_key and not used_specific_key:
-                    # Use specific key first
-                    api_key = self._get_next_key()
-                    used_specific_key = True
+        def cancelled():
+            return {
+                "success": False,
+                "cancelled": True,
+                "error": f"Cancelled: agent {cancel.winner} reached the quality threshold",
+                "attempts": attempt,
+                "elapsed": time.monotonic() - call_started
+            }
+        
+        def failure(reason):
+            error = f"{reason} (last error: {last_error})" if last_error else reason
+            print(f"[ERROR] Giving up after {attempt} attempt(s): {error}")
+            return {
+                "success": False,
+                "error": error,
+                "attempts": attempt,
+                "elapsed": time.monotonic() - call_started
+            }
+        
+        # Pre-flight: measure payloads near the context window and refuse ones that cannot fit,
+        # instead of retrying them until the deadline
+        input_limit = self._token_limits(model)["input"]
+        if estimated_tokens > input_limit * PREFLIGHT_COUNT_RATIO:
+            counted = self._count_tokens(model, payload)
+            if counted is not None:
+                estimated_tokens = counted
+            if estimated_tokens > input_limit:
+                return failure(f"Prompt is {'' if counted is not None else '~'}{estimated_tokens} tokens, "
+                               f"over the {input_limit} token input limit of {model}")
+        
+        while True:
+            if cancel is not None and cancel.cancelled:
+                return cancelled()
+            
+            # Use the pinned key first, then fall back to balanced rotation
+            pinned = key_number if attempt == 0 else None
+            api_key, used_key_number = self._get_next_key(pinned, estimated_tokens, deadline, model=model)
+            
+            if api_key is None:
+                if time.monotonic() >= deadline:
+                    return failure(f"No API key became available within the {policy.deadline:.0f}s deadline")
+                wait = self.key_health.wait_time(model)
+                if wait is None:
+                    return failure("All API keys were ejected after repeated invalid-key errors")
+                if time.monotonic() + wait >= deadline:
+                    return failure(f"All keys are cooling down past the {policy.deadline:.0f}s deadline")
+                print(f"All keys cooling down, waiting {wait:.1f}s...")
+                if cancel is not None:
+                    cancel.wait(wait)
                 else:
-                    # Fall back to balanced rotation from .env
-                    temp_specific_key = self.specific_key
-                    self.specific_key = None  # Temporarily disable specific key
-                    api_key = self._get_next_key()
-                    self.specific_key = temp_specific_key  # Restore specific key
-                
-                # Progressive timeout with cycling: 60s, 90s, 120s, 180s, then repeat
-                timeout_cycle = [60, 90, 120, 180]
-                timeout = timeout_cycle[attempt % len(timeout_cycle)]
-                
-                # Prepare payload
-                payload = {
-                    "contents": [{
-                        "parts": [{"text": prompt}]
-                    }]
-                }
-                
-                url = f"{self.base_url}?key={api_key}"
-                
-                # Make request with cycling timeout
-                response = requests.post(
-                    url,
-                    json=payload,
-                    timeout=timeout,
-                    headers={'Content-Type': 'application/json'}
-                )
+                    time.sleep(wait)
+                continue
+            
+            attempt += 1
+            
+            # Adaptive timeout from observed latency (escalated after timeouts), capped by the remaining deadline
+            timeout = self.latency.timeout(model, used_key_number, estimated_tokens, timeouts)
+            timeout = min(timeout, max(deadline - time.monotonic(), 1))
+            
+            # Reference the cached prefix on this key (creating it first if needed)
+            attempt_payload = payload
+            cache_name = None
+            if context_digest:
+                cache_name = self.context_cache.get_or_create(
+                    model, used_key_number, context_digest,
+                    (lambda: self._create_cached_content(model, api_key, context))
+                    if cache_context == "create" else None)
+                if cache_name:
+                    attempt_payload = dict(payload, cachedContent=cache_name,
+                                           contents=[{"role": "user", "parts": [{"text": prompt}]}])
+            
+            try:
+                # Make request over the pooled keep-alive session (streamed, or hedged on a second key when enabled)
+                with self._request_slots:
+                    if sink:
+                        outcome = self._stream_attempt(model, api_key, used_key_number, attempt_payload, timeout,
+                                                       sink, cancel)
+                    elif cancel is not None:
+                        outcome = self._cancellable_attempt(cancel, model, api_key, used_key_number, attempt_payload,
+                                                            timeout, estimated_tokens)
+                    else:
+                        outcome = self._send_attempt(model, api_key, used_key_number, attempt_payload, timeout,
+                                                     estimated_tokens)
+                if cancel is not None and cancel.cancelled:
+                    # Whatever this attempt did, its caller has lost the race; don't blame the key
+                    return cancelled()
+                api_key, used_key_number = outcome["api_key"], outcome["key_number"]
+                if outcome["error"] is not None:
+                    raise outcome["error"]
+                response = outcome["response"]
                 
                 if response.status_code == 200:
+                    latency = outcome["latency"]
+                    self.key_health.record_success(used_key_number, latency)
+                    self.latency.record(model, used_key_number, estimated_tokens, latency)
+                    policy.earn()
+                    response_json = outcome["json"] if outcome.get("json") is not None else response.json()
+                    if self.cache:
+                        self.cache.put(model, payload, response_json)
+                    if self.pacer:
+                        usage = response_json.get('usageMetadata', {})
+                        if usage.get('totalTokenCount'):
+                            self.pacer.settle(model, used_key_number, estimated_tokens, usage['totalTokenCount'])
                     return {
                         "success": True,
-                        "response": response.json(),
+                        "response": response_json,
                         "api_key_used": f"Key ending in ...{api_key[-4:]}",
-                        "attempt": attempt + 1,
+                        "key_number": used_key_number,
+                        "attempt": attempt,
                         "timeout_used": timeout
                     }
-                elif response.status_code == 403:
-                    print(f"Attempt {attempt + 1}: Rate limit (key ...{api_key[-4:]}), trying next key...")
-                    attempt += 1
-                    continue
-                elif response.status_code == 400:
-                    print(f"Attempt {attempt + 1}: Invalid key ...{api_key[-4:]}, trying next key...")
-                    attempt += 1
+                elif (cache_name and response.status_code in (400, 403, 404)
+                      and 'cachedcontent' in response.text.lower()):
+                    # The cache expired or was deleted server-side; resend with the prefix inline
+                    self.context_cache.invalidate(model, used_key_number, context_digest)
+                    context_digest = None
+                    last_error = f"Cached content {cache_name} rejected on key ...{api_key[-4:]}"
+                    print(f"Attempt {attempt}: {last_error}, resending the full prompt...")
                     continue
+                elif response.status_code in (403, 429):
+                    retry_after = self._retry_after_seconds(response)
+                    self.key_health.record_rate_limit(used_key_number, retry_after, model)
+                    last_error = f"HTTP {response.status_code} rate limit on key ...{api_key[-4:]}"
+                    print(f"Attempt {attempt}: Rate limit (key ...{api_key[-4:]}), cooling it down, trying next key...")
+                elif response.status_code == 400 and 'API key' in response.text:
+                    last_error = f"Invalid key ...{api_key[-4:]}"
+                    if self.key_health.record_invalid(used_key_number):
+                        print(f"Attempt {attempt}: Invalid key ...{api_key[-4:]}, ejected for this session")
+                    else:
+                        print(f"Attempt {attempt}: Invalid key ...{api_key[-4:]}, trying next key...")
+                elif response.status_code in (400, 404):
+                    # The request itself is rejected; another key or attempt will not fix it
+                    last_error = None
+                    return failure(f"HTTP {response.status_code}: {response.text[:200]}")
                 else:
-                    print(f"Attempt {attempt + 1}: HTTP {response.status_code} (key ...{api_key[-4:]}), trying next key...")
-                    attempt += 1
-                    continue
-                        
+                    self.key_health.record_failure(used_key_number)
+                    last_error = f"HTTP {response.status_code} on key ...{api_key[-4:]}"
+                    print(f"Attempt {attempt}: HTTP {response.status_code} (key ...{api_key[-4:]}), trying next key...")
+            
             except requests.exceptions.Timeout:
-                print(f"Attempt {attempt + 1}: Timeout after {timeout}s (key ...{api_key[-4:]}), trying next key...")
-                attempt += 1
-                continue
+                timeouts += 1
+                self.key_health.record_failure(used_key_number)
+                last_error = f"Timeout after {timeout:.0f}s on key ...{api_key[-4:]}"
+                print(f"Attempt {attempt}: Timeout after {timeout:.0f}s (key ...{api_key[-4:]}), trying next key...")
             except Exception as e:
-                print(f"Attempt {attempt + 1}: Error with key ...{api_key[-4:]} - {str(e)}, trying next key...")
-                attempt += 1
-                continue
+                self.key_health.record_failure(used_key_number)
+                last_error = f"{e} on key ...{api_key[-4:]}"
+                print(f"Attempt {attempt}: Error with key ...{api_key[-4:]} - {str(e)}, trying next key...")
+            
+            if attempt >= policy.max_attempts:
+                return failure(f"Retry limit of {policy.max_attempts} attempts reached")
+            if not policy.spend():
+                return failure("Client-wide retry budget exhausted")
+            
+            delay = policy.delay(attempt)
+            if time.monotonic() + delay >= deadline:
+                return failure(f"Deadline of {policy.deadline:.0f}s exceeded")
+            if cancel is not None:
+                cancel.wait(delay)
+            else:
+                time.sleep(delay)
+    
+    def _post_attempt(self, model, api_key, key_number, payload, timeout):
+        """POST one attempt and return its outcome instead of raising"""
+        started = time.monotonic()
+        try:
+            response = self.session.post(
+                f"{self._model_url(model)}?key={api_key}",
+                json=payload,
+                timeout=timeout
+            )
+            error = None
+        except Exception as e:
+            response, error = None, e
+        return {
+            "api_key": api_key,
+            "key_number": key_number,
+            "response": response,
+            "error": error,
+            "latency": time.monotonic() - started
+        }
+    
+    def _send_attempt(self, model, api_key, key_number, payload, timeout, tokens):
+        """Send one attempt, hedging it on a second healthy key if it outlives the observed p95
+        
+        The first successful outcome wins. The losing request is cancelled if it has not started,
+        otherwise abandoned and its response discarded when it arrives. Hedges are capped at
+        max_hedge_ratio of hedged calls and go through the pacer like any other call.
+        """
+        # A cachedContent reference only works on the key that created it, so those calls are not hedged
+        if not self.hedge or "cachedContent" in payload:
+            return self._post_attempt(model, api_key, key_number, payload, timeout)
+        
+        with self._hedge_lock:
+            self._hedge_stats["calls"] += 1
+        
+        hedge_after = self.latency.quantile(model, key_number, tokens, 95)
+        if hedge_after is None or hedge_after >= timeout:
+            return self._post_attempt(model, api_key, key_number, payload, timeout)
+        
+        primary = self._hedge_executor.submit(self._post_attempt, model, api_key, key_number, payload, timeout)
+        try:
+            return primary.result(timeout=hedge_after)
+        except FutureTimeoutError:
+            pass
+        
+        with self._hedge_lock:
+            allowed = self._hedge_stats["hedges"] < self.max_hedge_ratio * self._hedge_stats["calls"]
+            if allowed:
+                self._hedge_stats["hedges"] += 1
+        if not allowed:
+            return primary.result()
+        
+        hedge_key, hedge_number = self._get_next_key(tokens=tokens, exclude=key_number,
+                                                     deadline=time.monotonic(), model=model)
+        if hedge_key is None:
+            return primary.result()
+        
+        print(f"[HEDGE] Key ...{api_key[-4:]} slower than p95 ({hedge_after:.1f}s), "
+              f"hedging on key ...{hedge_key[-4:]}")
+        hedge = self._hedge_executor.submit(self._post_attempt, model, hedge_key, hedge_number, payload,
+                                            max(timeout - hedge_after, 1))
+        
+        pending = {primary, hedge}
+        outcomes = {}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                outcome = future.result()
+                if outcome["response"] is not None and outcome["response"].status_code == 200:
+                    for loser in pending:
+                        self._abandon(loser, model, tokens)
+                    if future is hedge:
+                        with self._hedge_lock:
+                            self._hedge_stats["wins"] += 1
+                    return outcome
+                outcomes[future] = outcome
+        
+        # Both failed: the hedge's failure still counts against its key, the primary's is returned
+        hedge_outcome = outcomes[hedge]
+        if hedge_outcome["response"] is not None and hedge_outcome["response"].status_code in (403, 429):
+            self.key_health.record_rate_limit(hedge_number, self._retry_after_seconds(hedge_outcome["response"]), model)
+        else:
+            self.key_health.record_failure(hedge_number)
+        return outcomes[primary]
+    
+    def _create_cached_content(self, model, api_key, context):
+        """Store context as cachedContent for model under api_key's project; returns its name or None"""
+        body = {
+            "model": f"models/{model}",
+            "contents": [{"role": "user", "parts": [{"text": context}]}],
+            "ttl": f"{self.context_cache.ttl}s"
+        }
+        try:
+            response = self.session.post(f"{self.api_base}/cachedContents?key={api_key}", json=body,
+                                         timeout=self.timeout)
+            if response.status_code != 200:
+                print(f"[CONTEXT CACHE] Could not cache prompt prefix (HTTP {response.status_code}): "
+                      f"{response.text[:200]}")
+                return None
+            name = response.json().get("name")
+        except (requests.exceptions.RequestException, ValueError, AttributeError) as e:
+            print(f"[CONTEXT CACHE] Could not cache prompt prefix: {e}")
+            return None
+        if not name:
+            print("[CONTEXT CACHE] Could not cache prompt prefix: response has no cache name")
+            return None
+        
+        print(f"[CONTEXT CACHE] Cached ~{self._estimate_tokens(context)} token prefix as {name} "
+              f"on key ...{api_key[-4:]} for {self.context_cache.ttl}s")
+        return name
+    
+    def _release_context_caches(self):
+        """Delete the cachedContents this session created instead of waiting for their TTL"""
+        for key_number, name in self.context_cache.drain():
+            try:
+                self.session.delete(f"{self.api_base}/{name}?key={self.api_keys[key_number - 1]}",
+                                    timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                print(f"[CONTEXT CACHE] Could not delete {name}: {e}")
+    
+    def _cancellable_attempt(self, cancel, model, api_key, key_number, payload, timeout, tokens):
+        """Send one attempt on the race pool so the caller can walk away when cancel fires
+        
+        Returns the attempt's outcome, or None once cancelled; the abandoned request's response
+        is closed when it arrives.
+        """
+        future = self._race_executor.submit(self._send_attempt, model, api_key, key_number, payload, timeout, tokens)
+        while True:
+            try:
+                return future.result(timeout=0.25)
+            except FutureTimeoutError:
+                if cancel.cancelled:
+                    self._abandon(future, model, tokens)
+                    return None
+    
+    def _stream_attempt(self, model, api_key, key_number, payload, timeout, sink, cancel=None):
+        """POST one attempt to the SSE streaming endpoint, feeding text chunks to sink as they arrive
+        
+        The read timeout between chunks is stream_stall_timeout, so a stalled stream fails early;
+        timeout still bounds the whole stream. On success the outcome carries the assembled
+        response in generateContent shape under "json". A cancel token closes the stream early.
+        """
+        started = time.monotonic()
+        stream_url = self._model_url(model, "streamGenerateContent")
+        outcome = {
+            "api_key": api_key,
+            "key_number": key_number,
+            "response": None,
+            "error": None,
+            "json": None
+        }
+        response = None
+        try:
+            response = self.session.post(
+                f"{stream_url}?alt=sse&key={api_key}",
+                json=payload,
+                timeout=(min(timeout, 30), min(timeout, self.stream_stall_timeout)),
+                stream=True
+            )
+            outcome["response"] = response
+            if cancel is not None:
+                cancel.track(response)
+            if response.status_code == 200:
+                sink.reset()
+                parts = []
+                usage = None
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    chunk = json.loads(line[len('data:'):].strip())
+                    text = self._extract_response_text(chunk)
+                    if text:
+                        parts.append(text)
+                        sink.write(text)
+                    usage = chunk.get('usageMetadata', usage)
+                    if time.monotonic() - started > timeout:
+                        raise requests.exceptions.Timeout(f"stream still running after {timeout:.0f}s")
+                
+                assembled = {"candidates": [{"content": {"parts": [{"text": ''.join(parts)}], "role": "model"}}]}
+                if usage:
+                    assembled["usageMetadata"] = usage
+                outcome["json"] = assembled
+        except requests.exceptions.ConnectionError as e:
+            # requests reports a read timeout inside a streamed body as a ConnectionError
+            if 'timed out' in str(e):
+                outcome["error"] = requests.exceptions.Timeout(f"stream stalled for {self.stream_stall_timeout}s")
+            else:
+                outcome["error"] = e
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            # Release the connection whether the stream finished, failed or was cut short
+            if response is not None:
+                if response.status_code != 200:
+                    try:
+                        response.content  # keep the error body readable after close
+                    except Exception:
+                        pass
+                response.close()
+                if cancel is not None:
+                    cancel.untrack(response)
+        outcome["latency"] = time.monotonic() - started
+        return outcome
+    
+    def _abandon(self, future, model, tokens):
+        """Cancel a losing hedge request, or discard its response once it completes
+        
+        A late success still feeds the key's health and latency stats so slow keys get noticed.
+        """
+        if future.cancel():
+            return
+        
+        def discard(done_future):
+            outcome = done_future.result()
+            response = outcome["response"]
+            if response is None:
+                return
+            if response.status_code == 200:
+                self.key_health.record_success(outcome["key_number"], outcome["latency"])
+                self.latency.record(model, outcome["key_number"], tokens, outcome["latency"])
+            response.close()
+        
+        future.add_done_callback(discard)
+    
+    def _retry_after_seconds(self, response):
+        """Parse a Retry-After header (seconds or HTTP date) into seconds, or None"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max((retry_at - datetime.now(retry_at.tzinfo)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            return None
     
     def _extract_response_text(self, response_json):
         """Extract text from Gemini API response"""
@@ -245,103 +2021,199 @@ class EnhancedGeminiClient:
             print(f"Error extracting response text: {e}")
         return ""
     
-    def _create_research_report(self, prompt, response_text, output_dir="outputs", used_key_number=None):
-        """Create a research report file"""
-        try:
-            # Create output directory
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # Determine agent number for filename prefix
-            if self.specific_key:
-                agent_number = self.specific_key
-            elif used_key_number:
-                agent_number = used_key_number
-            else:
-                # Fallback to current index (this shouldn't happen in normal usage)
-                agent_number = self._load_key_index()
-            
-            # Generate filename based on prompt with AGENT prefix
-            topic_keywords = self._extract_topic_keywords(prompt)
-            filename = f"AGENT{agent_number}_{topic_keywords}_RESEARCH.md"
-            
-            filepath = os.path.join(output_dir, filename)
-            
-            # Create report content
-            report_content = f"""# Research Report
-**Topic:** {prompt}
+    def _report_agent_number(self, used_key_number=None):
+        """Agent number used as the report filename prefix"""
+        if self.specific_key:
+            return self.specific_key
+        elif used_key_number:
+            return used_key_number
+        # Fallback to current index (this shouldn't happen in normal usage)
+        return self._current_key_number()
+    
+    def _report_path(self, kind, prompt, output_dir, agent_number):
+        """Path of the AGENT-prefixed report file for a research or task prompt"""
+        keywords = self._extract_topic_keywords(prompt)
+        return os.path.join(output_dir, f"AGENT{agent_number}_{keywords}_{REPORT_FORMATS[kind]['suffix']}.md")
+    
+    def _report_template(self, kind, prompt):
+        """Header and footer that wrap the model's text in a research or task report"""
+        report_format = REPORT_FORMATS[kind]
+        header = f"""# {report_format['title']}
+**{report_format['label']}:** {prompt}
 **Generated:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 **Model:** {self.model}
 
 ---
 
-## Research Findings
+## {report_format['section']}
 
-{response_text}
+"""
+        footer = f"""
 
 ---
 
-*Report generated by Enhanced Gemini Client*
+*{report_format['footer']}*
 """
+        return header, footer
+    
+    def _write_report(self, kind, prompt, response_text, output_dir, used_key_number):
+        """Write a complete report file and return its path, or None on failure"""
+        try:
+            # Create output directory
+            os.makedirs(output_dir, exist_ok=True)
+            
+            agent_number = self._report_agent_number(used_key_number)
+            filepath = self._report_path(kind, prompt, output_dir, agent_number)
+            header, footer = self._report_template(kind, prompt)
             
             with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(report_content)
+                f.write(header + response_text + footer)
             
             self.last_created_file = filepath
-            print(f"[CREATED] Research report: {filename} (using agent key: {agent_number})")
+            self._report_written(kind, prompt, filepath, header + response_text + footer, agent_number, used_key_number)
+            print(f"[CREATED] {REPORT_FORMATS[kind]['name']}: {os.path.basename(filepath)} (using agent key: {agent_number})")
             return filepath
             
         except Exception as e:
-            print(f"Error creating research report: {e}")
+            print(f"Error creating {REPORT_FORMATS[kind]['name'].lower()}: {e}")
             return None
     
+    def _create_research_report(self, prompt, response_text, output_dir="outputs", used_key_number=None):
+        """Create a research report file"""
+        return self._write_report("research", prompt, response_text, output_dir, used_key_number)
+    
     def _create_task_report(self, task_description, response_text, output_dir="outputs", used_key_number=None):
         """Create a task completion report file"""
+        return self._write_report("task", task_description, response_text, output_dir, used_key_number)
+    
+    def _write_revision(self, filepath, response_text):
+        """Write a revised report over its file as returned
+        
+        Agents revise the whole report file, header and footer included, so the revision is
+        written raw rather than wrapped in a second template.
+        """
         try:
-            # Create output directory
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # Determine agent number for filename prefix
-            if self.specific_key:
-                agent_number = self.specific_key
-            elif used_key_number:
-                agent_number = used_key_number
-            else:
-                # Fallback to current index
-                agent_number = self._load_key_index()
-            
-            # Generate filename based on task with AGENT prefix
-            task_keywords = self._extract_topic_keywords(task_description)
-            filename = f"AGENT{agent_number}_{task_keywords}_TASK.md"
-            
-            filepath = os.path.join(output_dir, filename)
-            
-            # Create task report content
-            report_content = f"""# Task Completion Report
-**Task:** {task_description}
-**Generated:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-**Model:** {self.model}
-
----
-
-## Task Results
-
-{response_text}
-
----
-
-*Task completed by Enhanced Gemini Client*
-"""
-            
             with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(report_content)
-            
-            self.last_created_file = filepath
-            print(f"[CREATED] Task report: {filename} (using agent key: {agent_number})")
-            return filepath
-            
+                f.write(response_text)
         except Exception as e:
-            print(f"Error creating task report: {e}")
+            return {
+                "success": False,
+                "error": f"Failed to write improved content: {e}"
+            }
+        
+        self._report_revised(filepath, response_text)
+        print(f"[UPDATED] File updated: {filepath}")
+        return {
+            "success": True,
+            "filepath": filepath,
+            "filename": os.path.basename(filepath),
+            "response": response_text
+        }
+    
+    def _read_report(self, filepath):
+        """(kind, prompt, body) parsed from a report file written by this client, or None"""
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError):
             return None
+        for kind, report_format in REPORT_FORMATS.items():
+            match = re.match(rf"# {re.escape(report_format['title'])}\n\*\*{report_format['label']}:\*\* (.*?)\n"
+                             rf"\*\*Generated:\*\*.*?\n## {re.escape(report_format['section'])}\n\n", text, re.S)
+            if match:
+                body = text[match.end():]
+                footer_start = body.rfind("\n\n---\n\n*")
+                return kind, match.group(1), body[:footer_start] if footer_start >= 0 else body
+        return None
+    
+    def _report_written(self, kind, prompt, filepath, markdown, agent_number, key_number):
+        """Record a newly created report in the near-duplicate index and the report store"""
+        if self.dedup_index is not None:
+            self.dedup_index.add(kind, prompt, os.path.abspath(filepath))
+        if self.report_store is not None:
+            self.report_store.add(kind, prompt, os.path.abspath(filepath), markdown, agent=agent_number,
+                                  key_number=key_number, model=self.model)
+    
+    def _report_revised(self, filepath, markdown):
+        """Bring the report store's copy of a rewritten report up to date"""
+        if self.report_store is None:
+            return
+        path = os.path.abspath(filepath)
+        if not self.report_store.update(path, markdown=markdown, model=self.improvement_model):
+            # Written before the store was in use: start tracking it if it is one of ours
+            report = self._read_report(filepath)
+            if report:
+                self.report_store.add(report[0], report[1], path, markdown, model=self.improvement_model)
+    
+    def _index_existing_reports(self, output_dir):
+        """Bring reports written outside this index (older runs, other tools) into it, once per directory"""
+        output_dir = os.path.abspath(output_dir)
+        with self._dedup_lock:
+            if output_dir in self._dedup_scanned or not os.path.isdir(output_dir):
+                return
+            self._dedup_scanned.add(output_dir)
+            entries = list(os.scandir(output_dir))
+        for entry in entries:
+            if not (entry.name.startswith("AGENT") and entry.name.endswith(".md")):
+                continue
+            path = os.path.abspath(entry.path)
+            indexed = self.dedup_index.entries.get(path)
+            if indexed and indexed["time"] >= datetime.fromtimestamp(entry.stat().st_mtime).isoformat(timespec='seconds'):
+                continue
+            report = self._read_report(path)
+            if report:
+                self.dedup_index.add(report[0], report[1], path)
+    
+    def _similar_reports(self, kind, prompt, output_dir):
+        """Indexed reports of this kind whose prompt is a near-duplicate of prompt, most similar first
+        
+        Entries whose file has gone or now answers a different prompt are dropped from the index.
+        """
+        self._index_existing_reports(output_dir)
+        similar = []
+        for score, entry in self.dedup_index.find(prompt, kind):
+            report = self._read_report(entry["path"])
+            if report is None or report[1] != entry["prompt"]:
+                self.dedup_index.discard(entry["path"])
+                continue
+            similar.append((score, entry, report[2]))
+        for score, entry, _ in similar:
+            print(f"[SIMILAR] {score:.0%} match: {os.path.basename(entry['path'])} ({entry['prompt'][:80]})")
+        return similar
+    
+    def _stream_report(self, kind, prompt, output_dir, key_number=None, used_key_number=None):
+        """Generate a report over the streaming endpoint, writing chunks into it as they arrive
+        
+        Returns (result, filepath); filepath is None when the call or the file write failed.
+        used_key_number fixes the filename prefix up front, otherwise the key that answered is used.
+        """
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            header, footer = self._report_template(kind, prompt)
+            writer = StreamingReportWriter(output_dir, header, footer, echo=self.echo)
+        except OSError as e:
+            print(f"Error creating {REPORT_FORMATS[kind]['name'].lower()}: {e}")
+            return self._make_request(prompt, key_number), None
+        
+        result = self._make_request(prompt, key_number, sink=writer)
+        if not result["success"]:
+            writer.abort()
+            return result, None
+        
+        agent_number = self._report_agent_number(used_key_number or result["key_number"])
+        filepath = self._report_path(kind, prompt, output_dir, agent_number)
+        try:
+            writer.commit(filepath)
+        except OSError as e:
+            writer.abort()
+            print(f"Error creating {REPORT_FORMATS[kind]['name'].lower()}: {e}")
+            return result, None
+        
+        self.last_created_file = filepath
+        self._report_written(kind, prompt, filepath, header + self._extract_response_text(result["response"]) + footer,
+                             agent_number, used_key_number or result["key_number"])
+        print(f"[CREATED] {REPORT_FORMATS[kind]['name']}: {os.path.basename(filepath)} (using agent key: {agent_number})")
+        return result, filepath
     
     def _create_task_variants(self, base_task, agent_count):
         """Split task into different approaches/angles for multiple agents"""
@@ -390,12 +2262,23 @@ class EnhancedGeminiClient:
             
             return variants
     
-    def _assess_task_quality(self, task_result, original_task):
-        """Assess task completion quality using task-specific criteria"""
-        # Simple quality assessment prompt
-        assessment_prompt = f"""Please assess the quality of this task completion on a scale of 1-10 based on the following criteria:
+    def _report_context(self, original_task, report_text):
+        """Task and report block that leads the assessment and task improvement prompts
+        
+        Both prompts for one report version start with exactly this text, so with context caching
+        on it is uploaded once per key when an improvement will follow the assessment, and
+        referenced by that later call.
+        """
+        return f"""ORIGINAL TASK: {original_task}
 
-TASK COMPLETION (40% weight):
+TASK RESULT:
+{report_text}
+
+"""
+    
+    def _assessment_criteria(self):
+        """Grading criteria shared by the assessment and critique-and-revise prompts"""
+        return """TASK COMPLETION (40% weight):
 - Addresses all aspects of the request
 - Provides actionable outputs  
 - Clear structure and organization
@@ -408,53 +2291,175 @@ ACCURACY & RELEVANCE (30% weight):
 PRACTICAL VALUE (30% weight):
 - Implementable solutions
 - Real-world applicability
-- Clear next steps
+- Clear next steps"""
+    
+    def _assessment_rubric(self, task_result, original_task):
+        """Grading criteria and material for the critique-and-revise prompt"""
+        return f"""{self._assessment_criteria()}
 
 ORIGINAL TASK: {original_task}
 
 TASK RESULT TO ASSESS:
-{task_result}
+{task_result}"""
+    
+    def _parse_score(self, assessment_text):
+        """Extract the SCORE: value from an assessment, or None if there is none"""
+        try:
+            for line in assessment_text.split('\n'):
+                if line.strip().startswith('SCORE:'):
+                    return float(line.split(':')[1].strip())
+        except ValueError:
+            pass
+        return None
+    
+    def _assess_task_quality(self, task_result, original_task, key_number=None, followup=False):
+        """Assess task completion quality using task-specific criteria (JSON response mode)
+        
+        followup says an improvement of this same report version may read the report context
+        next, which is the only case where uploading it as a context cache pays off.
+        """
+        # Simple quality assessment prompt
+        context = self._report_context(original_task, task_result)
+        assessment_prompt = f"""Please assess the quality of the task result above on a scale of 1-10 based on the following criteria:
+
+{self._assessment_criteria()}
+
+Respond with a JSON object containing:
+- "score": a numerical score from 1-10
+- "explanation": brief explanation of the score
+- "improvements": specific areas for improvement if score < 7, or "None" if score >= 7"""
+
+        # Make assessment request (this uses key rotation unless a key is pinned)
+        fields = self._request_assessment(assessment_prompt, ASSESSMENT_SCHEMA, key_number,
+                                          self.assessment_model, context, "create" if followup else "reuse")
+        if fields is None:
+            return {"score": 5, "assessment": "Assessment failed", "failed": True}
+        
+        return {
+            "score": fields["score"],
+            "assessment": self._format_assessment(fields),
+            "improvements": fields["improvements"]
+        }
+    
+    def _critique_and_revise(self, task_result, original_task, key_number=None):
+        """Score a task result and, when it is below threshold, get the revised result in the same call
+        
+        Returns the same fields as _assess_task_quality plus "revised" (None when the score meets
+        the threshold or the model did not include a revision).
+        """
+        critique_prompt = f"""Please assess the quality of this task completion on a scale of 1-10 based on the following criteria, and revise it if it falls short:
 
-Please provide:
-1. A numerical score from 1-10
-2. Brief explanation of the score
-3. Specific areas for improvement if score < 7
+{self._assessment_rubric(task_result, original_task)}
 
-Format your response as:
-SCORE: [number]
-EXPLANATION: [brief explanation]
-IMPROVEMENTS: [specific improvements needed, or "None" if score >= 7]"""
+Respond with a JSON object containing:
+- "score": a numerical score from 1-10
+- "explanation": brief explanation of the score
+- "improvements": specific areas for improvement if score < 7, or "None" if score >= 7
+- "revised_report": if score < 7, the complete revised task result in markdown addressing those improvements, keeping the same header information; otherwise an empty string"""
 
-        # Make assessment request (this uses next available key)
-        original_specific_key = self.specific_key
-        self.specific_key = None  # Use key rotation for assessment
+        # The critique also writes the revision, so it runs on the improvement model
+        fields = self._request_assessment(critique_prompt, CRITIQUE_SCHEMA, key_number, self.improvement_model)
+        if fields is None:
+            return {"score": 5, "assessment": "Assessment failed", "revised": None, "failed": True}
         
+        return {
+            "score": fields["score"],
+            "assessment": self._format_assessment(fields),
+            "improvements": fields["improvements"],
+            "revised": fields["revised_report"] if fields["score"] < 7.0 else None
+        }
+    
+    def _parse_assessment_json(self, text, require_revision=False):
+        """Validate a JSON-mode assessment; returns its fields or raises ValueError"""
         try:
-            result = self._make_request(assessment_prompt)
-            if result["success"]:
-                assessment_text = self._extract_response_text(result["response"])
-                
-                # Extract score from assessment
-                score = 5  # default fallback
-                try:
-                    for line in assessment_text.split('\n'):
-                        if line.strip().startswith('SCORE:'):
-                            score = float(line.split(':')[1].strip())
-                            break
-                except:
-                    pass
-                
-                return {
-                    "score": score,
-                    "assessment": assessment_text
-                }
-            else:
-                return {"score": 5, "assessment": "Assessment failed"}
-        finally:
-            self.specific_key = original_specific_key
+            data = json.loads(text)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"not valid JSON: {e}")
+        if not isinstance(data, dict):
+            raise ValueError("expected a JSON object")
+        
+        score = data.get("score")
+        if isinstance(score, str):
+            try:
+                score = float(score)
+            except ValueError:
+                raise ValueError(f"score is not a number: {score!r}")
+        if isinstance(score, bool) or not isinstance(score, (int, float)) or not 1 <= score <= 10:
+            raise ValueError(f"score must be a number from 1 to 10, got {score!r}")
+        
+        for field in ("explanation", "improvements"):
+            if not isinstance(data.get(field), str):
+                raise ValueError(f"missing or non-string '{field}'")
+        
+        revised = data.get("revised_report")
+        if revised is not None and not isinstance(revised, str):
+            raise ValueError("'revised_report' must be a string")
+        if require_revision and score < 7.0 and not (revised or "").strip():
+            raise ValueError("score is below 7 but 'revised_report' is empty")
+        
+        return {
+            "score": float(score),
+            "explanation": data["explanation"].strip(),
+            "improvements": data["improvements"].strip(),
+            "revised_report": (revised or "").strip() or None
+        }
+    
+    def _request_assessment(self, prompt, schema, key_number=None, model=None, context=None, cache_context="reuse"):
+        """Run an assessment in JSON response mode and return validated fields, or None if it failed
+        
+        Output that does not match the schema is re-asked once with a short repair prompt that only
+        carries the malformed answer, not the rubric or the report. If that also fails, a legacy
+        SCORE: line is used when present.
+        """
+        result = self._make_request(prompt, key_number, generation_config=self._json_config(schema), model=model,
+                                    context=context, cache_context=cache_context)
+        if not result["success"]:
+            return None
+        
+        raw_text = self._extract_response_text(result["response"])
+        require_revision = "revised_report" in schema["properties"]
+        try:
+            return self._parse_assessment_json(raw_text, require_revision)
+        except ValueError as e:
+            print(f"[ASSESS] Malformed assessment ({e}), asking for a corrected JSON answer...")
+        
+        repair_prompt = f"""The following assessment does not match the required JSON format. Return the same assessment as a JSON object with "score" (a number from 1-10), "explanation" and "improvements"{' and "revised_report" (the complete revised result, or an empty string if score >= 7)' if require_revision else ''}. Do not change its content.
+
+ASSESSMENT:
+{raw_text}"""
+        # Reformatting is light work, so the repair always goes to the assessment model
+        repair = self._make_request(repair_prompt, key_number, generation_config=self._json_config(schema),
+                                    model=self.assessment_model)
+        if repair["success"]:
+            try:
+                return self._parse_assessment_json(self._extract_response_text(repair["response"]), require_revision)
+            except ValueError as e:
+                print(f"[ASSESS] Corrected assessment still malformed ({e})")
+        
+        score = self._parse_score(raw_text)
+        if score is None:
+            return None
+        return {"score": score, "explanation": raw_text, "improvements": "", "revised_report": None}
+    
+    def _json_config(self, schema):
+        """generationConfig for Gemini's JSON response mode with a response schema"""
+        return {
+            "responseMimeType": "application/json",
+            "responseSchema": schema
+        }
+    
+    def _format_assessment(self, fields):
+        """Render structured assessment fields in the SCORE/EXPLANATION/IMPROVEMENTS layout"""
+        return (f"SCORE: {fields['score']:g}\n"
+                f"EXPLANATION: {fields['explanation']}\n"
+                f"IMPROVEMENTS: {fields['improvements'] or 'None'}")
     
-    def _generate_improvement_points(self, task_result, assessment_text):
+    def _generate_improvement_points(self, task_result, assessment_text, improvements=None):
         """Generate specific improvement suggestions for task completion"""
+        # Structured assessments carry the improvements directly
+        if improvements and improvements.strip().lower() != "none":
+            return improvements
+        
         try:
             # Extract improvements from assessment
             for line in assessment_text.split('\n'):
@@ -472,174 +2477,755 @@ IMPROVEMENTS: [specific improvements needed, or "None" if score >= 7]"""
         """Conduct research and create a report"""
         print(f"[RESEARCH] Starting research on: {prompt[:100]}...")
         
-        # Make request to Gemini
-        result = self._make_request(prompt)
+        if self.dedup_index is not None:
+            similar = self._similar_reports("research", prompt, output_dir)
+            if similar and self.dedup == "reuse":
+                score, entry, body = similar[0]
+                print(f"[REUSED] Returning existing report instead of a new API call: {entry['path']}")
+                self.last_created_file = entry["path"]
+                return {
+                    "success": True,
+                    "filepath": entry["path"],
+                    "filename": os.path.basename(entry["path"]),
+                    "response": body,
+                    "api_key_used": None,
+                    "key_number": None,
+                    "reused": True,
+                    "similarity": score,
+                    "similar_prompt": entry["prompt"]
+                }
+        
+        # Make request to Gemini (streamed straight into the report file in streaming mode)
+        if self.stream:
+            result, filepath = self._stream_report("research", prompt, output_dir, self.specific_key)
+        else:
+            result = self._make_request(prompt, self.specific_key)
+            filepath = None
         
         if result["success"]:
             response_text = self._extract_response_text(result["response"])
             print(f"[SUCCESS] Research completed using {result['api_key_used']}")
             
             # Create research report
-            filepath = self._create_research_report(prompt, response_text, output_dir, self.last_used_key_number)
+            if filepath is None:
+                filepath = self._create_research_report(prompt, response_text, output_dir, result["key_number"])
             
             if filepath:
                 return {
                     "success": True,
                     "filepath": filepath,
                     "filename": os.path.basename(filepath),
-                    "response": response_text
+                    "response": response_text,
+                    "api_key_used": result["api_key_used"],
+                    "key_number": result["key_number"]
                 }
             else:
                 return {
                     "success": False,
-                    "error": "Failed to create research report"
+                    "error": "Failed to create research report"
+                }
+        else:
+            print(f"[ERROR] Research failed: {result['error']}")
+            return {
+                "success": False,
+                "error": result['error']
+            }
+    
+    def research_documents(self, prompt, paths, output_dir="outputs"):
+        """Map-reduce research over local Markdown documents
+        
+        Each file is packed into as few chunks of up to chunk_tokens as its top-level sections
+        allow (a file within budget is a single chunk), the research question is
+        asked of every chunk concurrently across keys (map), and the partial findings are merged
+        into one report (reduce). Map prompts depend only on the chunk's source and text, not its
+        position, so with the response cache a re-run only recomputes chunks that changed.
+        """
+        chunks = []
+        for path in paths:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    text = f.read()
+            except OSError as e:
+                return {
+                    "success": False,
+                    "error": f"Failed to read {path}: {e}"
+                }
+            for chunk in split_markdown_sections(text, self.chunk_tokens, self._estimate_tokens, boundary_level=2):
+                if chunk.strip():
+                    heading = re.search(r'^#{1,6}\s+(.+)$', chunk, re.MULTILINE)
+                    chunks.append({
+                        "source": os.path.basename(path),
+                        "section": heading.group(1).strip() if heading else "opening section",
+                        "text": chunk
+                    })
+        if not chunks:
+            return {
+                "success": False,
+                "error": "The documents have no content to research"
+            }
+        
+        print(f"[MAP-REDUCE] Researching {len(paths)} document(s) in {len(chunks)} chunk(s): {prompt[:100]}...")
+        results = self._map_chunks(prompt, chunks)
+        findings = [
+            f"SOURCE: {chunk['source']} / {chunk['section']}\n{self._extract_response_text(result['response']).strip()}"
+            for chunk, result in zip(chunks, results)
+            if result["success"] and 'NO RELEVANT CONTENT' not in self._extract_response_text(result['response'])
+        ]
+        failed = sum(1 for result in results if not result["success"])
+        cached = sum(1 for result in results if result.get("cached"))
+        if failed == len(chunks):
+            return {
+                "success": False,
+                "error": f"All {len(chunks)} chunk(s) failed: {results[0]['error']}"
+            }
+        if failed:
+            print(f"[MAP-REDUCE] {failed} chunk(s) failed and are left out of the report")
+        if not findings:
+            findings = ["No excerpt contained content relevant to the question."]
+        
+        result = self._reduce_findings(prompt, findings, len(chunks))
+        if not result["success"]:
+            print(f"[ERROR] Research failed: {result['error']}")
+            return {
+                "success": False,
+                "error": result['error']
+            }
+        
+        response_text = self._extract_response_text(result["response"])
+        filepath = self._create_research_report(prompt, response_text, output_dir, result["key_number"])
+        if not filepath:
+            return {
+                "success": False,
+                "error": "Failed to create research report"
+            }
+        return {
+            "success": True,
+            "filepath": filepath,
+            "filename": os.path.basename(filepath),
+            "response": response_text,
+            "api_key_used": result["api_key_used"],
+            "key_number": result["key_number"],
+            "chunks": len(chunks),
+            "cached_chunks": cached,
+            "failed_chunks": failed
+        }
+    
+    def _map_chunks(self, prompt, chunks):
+        """Ask the research question of every chunk concurrently; returns results in chunk order"""
+        def map_chunk(chunk):
+            map_prompt = f"""You are reading one excerpt of a larger set of documents to help answer a research question.
+
+RESEARCH QUESTION:
+{prompt}
+
+SOURCE: {chunk['source']} / {chunk['section']}
+EXCERPT:
+{chunk['text']}
+
+INSTRUCTIONS:
+1. Extract every fact, requirement, decision and figure in this excerpt that bears on the question
+2. Note gaps, risks or contradictions visible within the excerpt
+3. Be concise; use bullet points
+4. If nothing in the excerpt is relevant, reply with exactly: NO RELEVANT CONTENT
+
+Findings:"""
+            return self._make_request(map_prompt)
+        
+        results = [None] * len(chunks)
+        cached = failed = 0
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(chunks)), thread_name_prefix="map") as executor:
+            futures = {executor.submit(map_chunk, chunk): index for index, chunk in enumerate(chunks)}
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                results[futures[future]] = result
+                cached += 1 if result.get("cached") else 0
+                failed += 0 if result["success"] else 1
+                print_progress("MAP", done, len(chunks), f"{cached} cached, {failed} failed")
+        return results
+    
+    def _reduce_findings(self, prompt, findings, chunk_count):
+        """Merge partial findings into the final report, condensing them in rounds if they are too large
+        
+        Each round packs findings into groups of up to four chunk budgets and condenses the groups
+        in parallel, until everything fits in one final reduce call.
+        """
+        budget = self.chunk_tokens * 4
+        round_number = 1
+        while len(findings) > 1 and self._estimate_tokens('\n\n'.join(findings)) > budget:
+            groups = []
+            for finding in findings:
+                if groups and self._estimate_tokens('\n\n'.join(groups[-1] + [finding])) <= budget:
+                    groups[-1].append(finding)
+                else:
+                    groups.append([finding])
+            if len(groups) == len(findings):
+                break
+            
+            def condense(group):
+                condense_prompt = f"""Condense these findings about a research question into one consolidated list, merging duplicates and keeping every SOURCE reference.
+
+RESEARCH QUESTION:
+{prompt}
+
+FINDINGS:
+{chr(10).join(group)}
+
+Consolidated findings:"""
+                return self._make_request(condense_prompt)
+            
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(groups)), thread_name_prefix="reduce") as executor:
+                futures = [executor.submit(condense, group) for group in groups]
+                for done, _ in enumerate(as_completed(futures), 1):
+                    print_progress(f"REDUCE {round_number}", done, len(groups))
+            condensed = [future.result() for future in futures]
+            failures = [result for result in condensed if not result["success"]]
+            if failures:
+                return failures[0]
+            findings = [self._extract_response_text(result["response"]).strip() for result in condensed]
+            round_number += 1
+        
+        print(f"[REDUCE] Merging findings from {chunk_count} chunk(s) into the report...")
+        reduce_prompt = f"""You are writing a research report from findings extracted from {chunk_count} excerpt(s) of the source documents.
+
+RESEARCH QUESTION:
+{prompt}
+
+FINDINGS:
+{chr(10).join(findings)}
+
+INSTRUCTIONS:
+1. Merge the findings into one well-structured report that answers the research question
+2. Combine duplicates and point out contradictions between sources
+3. Reference the source document and section for key points
+4. Use markdown headings and end with conclusions and recommended next steps
+
+Please provide the complete research report:"""
+        return self._make_request(reduce_prompt)
+    
+    def delegate_task(self, task_description, agent_count=1, max_iterations=3, output_dir="outputs"):
+        """Delegate a task to multiple Gemini agents with iterative improvement
+        
+        Agents run concurrently (up to self.concurrency at a time), each pinned to its own key.
+        """
+        print(f"[DELEGATE] Starting task delegation: {task_description[:100]}...")
+        print(f"[DELEGATE] Spawning {agent_count} agent(s), max {max_iterations} iterations each")
+        
+        if self.dedup_index is not None:
+            # Agents run several calls each, so earlier task reports are pointed out, never substituted
+            self._similar_reports("task", task_description, output_dir)
+        
+        # Create task variants for multiple agents
+        task_variants = self._create_task_variants(task_description, agent_count)
+        
+        # Assign every agent its key up front so agents never share mutable key state
+        if self.specific_key is not None:
+            # Use the pre-assigned key (for orchestrated delegation)
+            agent_keys = [self.specific_key] * len(task_variants)
+            assignment = "Using assigned key"
+        else:
+            # Use automatic assignment for standalone delegation
+            agent_keys = self._reserve_keys(len(task_variants))
+            assignment = "Auto-assigned key"
+        
+        for i, agent_key in enumerate(agent_keys):
+            print(f"[AGENT {i + 1}] {assignment}: {agent_key}")
+        
+        journal = self._start_run("delegate", task_description, task_variants, agent_keys, max_iterations,
+                                  output_dir, pin_keys=False)
+        results = self._run_agents(task_variants, agent_keys, task_description, max_iterations, output_dir,
+                                   journal=journal)
+        
+        return {
+            "success": True,
+            "agent_count": agent_count,
+            "results": results,
+            "task_description": task_description,
+            "run_id": journal.run_id
+        }
+    
+    def orchestrate(self, task_description, agent_count, max_iterations=3, output_dir="outputs"):
+        """Fan agents out across the loaded keys, pinning every call of each agent to its own key"""
+        if agent_count < 1 or agent_count > len(self.api_keys):
+            return {
+                "success": False,
+                "error": f"Agent count must be between 1 and {len(self.api_keys)} (one key per agent)"
+            }
+        
+        print(f"[ORCHESTRATE] Starting orchestrated delegation: {task_description[:100]}...")
+        print(f"[ORCHESTRATE] Spawning {agent_count} agent(s) on {agent_count} key(s), max {max_iterations} iterations each")
+        
+        task_variants = self._create_task_variants(task_description, agent_count)
+        agent_keys = self._reserve_keys(agent_count)
+        
+        for i, agent_key in enumerate(agent_keys):
+            print(f"[AGENT {i + 1}] Pinned key: {agent_key}")
+        
+        journal = self._start_run("orchestrate", task_description, task_variants, agent_keys, max_iterations,
+                                  output_dir, pin_keys=True)
+        results = self._run_agents(task_variants, agent_keys, task_description, max_iterations, output_dir,
+                                   pin_keys=True, journal=journal)
+        
+        return {
+            "success": True,
+            "agent_count": agent_count,
+            "results": results,
+            "task_description": task_description,
+            "run_id": journal.run_id
+        }
+    
+    def _start_run(self, kind, task_description, task_variants, agent_keys, max_iterations, output_dir, pin_keys):
+        """Open a new run journal and record everything needed to resume the run"""
+        journal = RunJournal.create(self.runs_dir)
+        journal.record("run", kind=kind, task=task_description, variants=task_variants, keys=agent_keys,
+                       max_iterations=max_iterations, output_dir=os.path.abspath(output_dir), pin_keys=pin_keys,
+                       settings=self._run_settings())
+        print(f"[RUN] Journal: {journal.path} (resume with --resume {journal.run_id})")
+        return journal
+    
+    def resume_run(self, run_id):
+        """Continue a journaled delegate/orchestrate run from its last completed step
+        
+        Finished and cancelled agents keep their recorded results; the others restore their
+        latest draft (rewriting the report file from the journal) and skip any assessment that
+        was already recorded, so no completed call is paid for twice.
+        """
+        journal = RunJournal(os.path.join(self.runs_dir, f"{run_id}.jsonl"))
+        if not os.path.exists(journal.path):
+            return {
+                "success": False,
+                "error": f"No journal for run {run_id} in {self.runs_dir}"
+            }
+        try:
+            run, agents = journal.replay()
+        except (OSError, ValueError) as e:
+            return {
+                "success": False,
+                "error": f"Could not read run journal: {e}"
+            }
+        
+        self._restore_run_settings(run.get("settings") or {})
+        pending = [number for number in range(1, len(run["variants"]) + 1)
+                   if not (agents.get(number) or {}).get("result")]
+        print(f"[RUN] Resuming {run['kind']} run {run_id}: {run['task'][:100]}...")
+        print(f"[RUN] {len(run['variants']) - len(pending)} agent(s) already finished, resuming {len(pending)}")
+        
+        results = self._run_agents(run["variants"], run["keys"], run["task"], run["max_iterations"],
+                                   run["output_dir"], pin_keys=run["pin_keys"], journal=journal, resume=agents)
+        return {
+            "success": True,
+            "agent_count": len(run["variants"]),
+            "results": results,
+            "task_description": run["task"],
+            "run_id": run_id
+        }
+    
+    def _run_settings(self):
+        """Client settings that change how a run's agents behave, recorded so a resume matches"""
+        return {
+            "quality_mode": self.quality_mode,
+            "race": self.race,
+            "model": self.model,
+            "assessment_model": self.assessment_model,
+            "improvement_model": self.improvement_model
+        }
+    
+    def _restore_run_settings(self, settings):
+        """Switch to a journaled run's settings, saying which command-line values they override"""
+        for name, value in settings.items():
+            if getattr(self, name) != value:
+                print(f"[RUN] Using the run's {name}={value} instead of {getattr(self, name)}")
+                setattr(self, name, value)
+        # Executors and caches that the new command line may not have set up for these settings
+        if self.quality_mode == "pipelined" and self._speculation_executor is None:
+            self._speculation_executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                                            thread_name_prefix="speculate")
+        if self.race and self._race_executor is None:
+            self._race_executor = ThreadPoolExecutor(max_workers=self.concurrency * 2, thread_name_prefix="race")
+        if self.context_cache and self.assessment_model != self.improvement_model:
+            print("[CONTEXT CACHE] Disabled: the run's assessment and improvement models differ")
+            self._release_context_caches()
+            self.context_cache = None
+    
+    def _reserve_keys(self, count):
+        """Reserve a block of consecutive key numbers from the rotation counter"""
+        start = self.key_counter.next(count)
+        return [((start + i) % len(self.api_keys)) + 1 for i in range(count)]
+    
+    def _run_agents(self, task_variants, agent_keys, task_description, max_iterations, output_dir, pin_keys=False,
+                    journal=None, resume=None):
+        """Run one agent per task variant concurrently and return their results in agent order
+        
+        In race mode all agents share one cancel token, so the first to reach the threshold stops the rest.
+        Each agent's progress goes to the journal; resume maps agent numbers to replayed journal state.
+        """
+        resume = resume or {}
+        race = CancelToken() if self.race and len(task_variants) > 1 else None
+        if race is not None:
+            winners = [number for number, state in resume.items()
+                       if state["result"] and state["result"].get("success") and state["result"]["final_quality"] >= 7.0]
+            if winners:
+                race.claim(winners[0])
+        
+        def run_agent(agent_num, variant_task):
+            state = resume.get(agent_num) or {}
+            result = state.get("result")
+            if result:
+                return result
+            result = self._with_cancel(race, self._run_agent, agent_num, variant_task, agent_keys[agent_num - 1],
+                                       task_description, max_iterations, output_dir, pin_keys, journal, state)
+            # Failed agents (or ones whose improvement failed) are not recorded as finished, so a resume retries them
+            if journal is not None and ((result.get("success") and not result.get("improvement_error"))
+                                        or result.get("cancelled")):
+                journal.record("agent", agent=agent_num, result=result)
+            return result
+        
+        workers = min(self.concurrency, len(task_variants))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent") as executor:
+            futures = [executor.submit(run_agent, i + 1, variant_task) for i, variant_task in enumerate(task_variants)]
+            return [future.result() for future in futures]
+    
+    def _run_agent(self, agent_num, variant_task, agent_key, task_description, max_iterations, output_dir,
+                   pin_key=False, journal=None, resume=None):
+        """Run one agent's initial call and quality improvement loop, returning its result entry
+        
+        With pin_key, assessment and improvement calls also go to the agent's key instead of rotation.
+        In race mode an agent that loses stops at its next call and its report is removed.
+        Drafts and scores are recorded in the journal; resume (replayed journal state) restarts
+        the agent from its latest draft and reuses recorded scores.
+        """
+        resume = resume or {}
+        
+        def record(event, **fields):
+            if journal is not None:
+                journal.record(event, agent=agent_num, **fields)
+        
+        race = getattr(self._local, "cancel", None)
+        if race is not None and race.cancelled:
+            return self._lost_race(agent_num, agent_key, variant_task, None)
+        
+        followup_key = agent_key if pin_key else None
+        
+        try:
+            draft = resume.get("draft")
+            if draft:
+                # Put the journaled draft back in case a later write was interrupted or lost
+                filepath = draft["filepath"]
+                response_text = draft["text"]
+                with open(filepath, 'w', encoding='utf-8') as f:
+                    f.write(response_text)
+                print(f"\n[AGENT {agent_num}] Resuming at iteration {draft['iteration']}: {os.path.basename(filepath)}")
+                return self._improve_agent_report(agent_num, variant_task, agent_key, task_description, max_iterations,
+                                                  followup_key, filepath, response_text, draft["iteration"],
+                                                  resume.get("scores", {}), record)
+            
+            print(f"\n[AGENT {agent_num}] Starting task: {variant_task[:80]}...")
+            
+            # Initial task execution (streamed straight into the report file in streaming mode)
+            if self.stream:
+                result, filepath = self._stream_report("task", variant_task, output_dir, agent_key, agent_key)
+            else:
+                result = self._make_request(variant_task, agent_key)
+                filepath = None
+            
+            if result.get("cancelled"):
+                return self._lost_race(agent_num, agent_key, variant_task, None)
+            
+            if not result["success"]:
+                print(f"[AGENT {agent_num}] Failed: {result['error']}")
+                return {
+                    "agent_number": agent_num,
+                    "task": variant_task,
+                    "success": False,
+                    "error": result['error']
                 }
-        else:
-            print(f"[ERROR] Research failed: {result['error']}")
+            
+            response_text = self._extract_response_text(result["response"])
+            print(f"[AGENT {agent_num}] Initial completion using {result['api_key_used']}")
+            
+            # Create initial task report
+            if filepath is None:
+                filepath = self._create_task_report(variant_task, response_text, output_dir, agent_key)
+            
+            # Assess the report file as written, the same text improve_task quotes, so both calls
+            # share one report context
+            if filepath:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    response_text = f.read()
+                record("draft", iteration=1, filepath=os.path.abspath(filepath), text=response_text)
+            
+            return self._improve_agent_report(agent_num, variant_task, agent_key, task_description, max_iterations,
+                                              followup_key, filepath, response_text, 1, {}, record)
+        
+        except Exception as e:
+            # Keep one agent's crash from taking down the others
+            print(f"[AGENT {agent_num}] Failed: {e}")
             return {
+                "agent_number": agent_num,
+                "task": variant_task,
                 "success": False,
-                "error": result['error']
+                "error": str(e)
             }
     
-    def delegate_task(self, task_description, agent_count=1, max_iterations=3, output_dir="outputs"):
-        """Delegate a task to multiple Gemini agents with iterative improvement"""
-        print(f"[DELEGATE] Starting task delegation: {task_description[:100]}...")
-        print(f"[DELEGATE] Spawning {agent_count} agent(s), max {max_iterations} iterations each")
+    def _improve_agent_report(self, agent_num, variant_task, agent_key, task_description, max_iterations,
+                              followup_key, filepath, response_text, iteration, scores, record):
+        """Quality improvement loop of _run_agent, starting at iteration with response_text as the draft
         
-        # Create task variants for multiple agents
-        task_variants = self._create_task_variants(task_description, agent_count)
+        scores holds assessments already recorded for earlier attempts at these iterations.
+        """
+        race = getattr(self._local, "cancel", None)
+        current_quality = 0
+        improvement_error = None
+        speculation = None
+        # Pipelined mode guides each speculative draft with the latest assessment available
+        speculation_points = SPECULATIVE_IMPROVEMENT_POINTS
         
-        results = []
-        
-        for i, variant_task in enumerate(task_variants):
-            agent_num = i + 1
-            print(f"\n[AGENT {agent_num}] Starting task: {variant_task[:80]}...")
+        # Quality improvement loop
+        while iteration <= max_iterations:
+            quality_result = scores.get(iteration)
+            if quality_result is None and self.quality_mode == "pipelined" and iteration < max_iterations:
+                speculation = self._start_speculation(filepath, speculation_points, followup_key,
+                                                      task_description)
             
-            # Temporarily set specific key for this agent
-            original_specific_key = self.specific_key
-            # If specific key was set during initialization, use it (orchestration mode)
-            if original_specific_key is not None:
-                # Use the pre-assigned key (for orchestrated delegation)
-                agent_key = original_specific_key
-                print(f"[AGENT {agent_num}] Using assigned key: {agent_key}")
+            # Assess quality (combined mode also returns the revision, except on the last iteration)
+            if quality_result is not None:
+                print(f"[AGENT {agent_num}] Iteration {iteration} assessment taken from the journal")
+            elif self.quality_mode == "combined" and iteration < max_iterations:
+                quality_result = self._critique_and_revise(response_text, task_description, followup_key)
             else:
-                # Use automatic assignment for standalone delegation
-                current_key_index = self._load_key_index()
-                agent_key = ((current_key_index - 1 + i) % len(self.api_keys)) + 1
-                self.specific_key = agent_key
-                print(f"[AGENT {agent_num}] Auto-assigned key: {agent_key}")
+                # Only a non-final draft small enough to improve in one call shares its context
+                # with a later improvement call
+                followup = (iteration < max_iterations
+                            and self._estimate_tokens(response_text) <= self.chunk_tokens)
+                quality_result = self._assess_task_quality(response_text, task_description, followup_key, followup)
+            if race is not None and race.cancelled:
+                if speculation is not None:
+                    self._discard_speculation(speculation, agent_num)
+                return self._lost_race(agent_num, agent_key, variant_task, filepath)
+            if iteration not in scores and not quality_result.get("failed"):
+                record("score", iteration=iteration, quality=quality_result)
+            current_quality = quality_result["score"]
+            if self.report_store is not None and not quality_result.get("failed"):
+                self.report_store.update(os.path.abspath(filepath), score=current_quality, iteration=iteration)
             
-            try:
-                # Initial task execution
-                result = self._make_request(variant_task)
+            print(f"[AGENT {agent_num}] Iteration {iteration} quality: {current_quality}/10")
+            
+            if current_quality >= 7.0:
+                print(f"[AGENT {agent_num}] Quality threshold met!")
+                if speculation is not None:
+                    self._discard_speculation(speculation, agent_num)
+                if race is not None and race.claim(agent_num):
+                    print(f"[RACE] Agent {agent_num} finished first, cancelling the other agents")
+                break
+            
+            if iteration >= max_iterations:
+                print(f"[AGENT {agent_num}] Max iterations reached")
+                break
+            
+            improve_result = None
+            if speculation is not None:
+                # The draft scored low, so the speculative improvement becomes the next draft and
+                # this assessment guides the following speculation
+                improve_result = self._finish_speculation(speculation, filepath, agent_num)
+                speculation = None
+                speculation_points = self._generate_improvement_points(response_text, quality_result["assessment"],
+                                                                       quality_result.get("improvements"))
+            
+            if improve_result is None and quality_result.get("revised"):
+                # Revision came back with the critique, no separate improvement call needed
+                improve_result = self._write_revision(filepath, quality_result["revised"])
+            elif improve_result is None:
+                # Generate improvement points
+                improvement_points = self._generate_improvement_points(response_text, quality_result["assessment"],
+                                                                       quality_result.get("improvements"))
                 
-                if result["success"]:
-                    response_text = self._extract_response_text(result["response"])
-                    print(f"[AGENT {agent_num}] Initial completion using {result['api_key_used']}")
-                    
-                    # Create initial task report
-                    filepath = self._create_task_report(variant_task, response_text, output_dir, self.last_used_key_number)
-                    
-                    current_quality = 0
-                    iteration = 1
-                    
-                    # Quality improvement loop
-                    while iteration <= max_iterations:
-                        # Assess quality
-                        quality_result = self._assess_task_quality(response_text, task_description)
-                        current_quality = quality_result["score"]
-                        
-                        print(f"[AGENT {agent_num}] Iteration {iteration} quality: {current_quality}/10")
-                        
-                        if current_quality >= 7.0:
-                            print(f"[AGENT {agent_num}] Quality threshold met!")
-                            break
-                        
-                        if iteration >= max_iterations:
-                            print(f"[AGENT {agent_num}] Max iterations reached")
-                            break
-                        
-                        # Generate improvement points
-                        improvement_points = self._generate_improvement_points(response_text, quality_result["assessment"])
-                        
-                        # Improve the task (uses key rotation)
-                        self.specific_key = None  # Use key rotation for improvement
-                        improve_result = self.improve_task(improvement_points, filepath)
-                        self.specific_key = agent_key  # Restore agent key
-                        
-                        if improve_result["success"]:
-                            response_text = improve_result["response"]
-                            print(f"[AGENT {agent_num}] Iteration {iteration + 1} improvement completed")
-                        else:
-                            print(f"[AGENT {agent_num}] Improvement failed: {improve_result['error']}")
-                            break
-                        
-                        iteration += 1
-                    
-                    # Final result for this agent
-                    agent_result = {
-                        "agent_number": agent_num,
-                        "task": variant_task,
-                        "filepath": filepath,
-                        "filename": os.path.basename(filepath),
-                        "final_quality": current_quality,
-                        "iterations": iteration,
-                        "success": True
-                    }
-                    results.append(agent_result)
-                    
-                else:
-                    print(f"[AGENT {agent_num}] Failed: {result['error']}")
-                    results.append({
-                        "agent_number": agent_num,
-                        "task": variant_task,
-                        "success": False,
-                        "error": result['error']
-                    })
+                # Improve the task (uses key rotation unless the agent is pinned)
+                improve_result = self.improve_task(improvement_points, filepath, followup_key, task_description)
             
-            finally:
-                self.specific_key = original_specific_key
+            if race is not None and race.cancelled:
+                return self._lost_race(agent_num, agent_key, variant_task, filepath)
+            
+            if improve_result["success"]:
+                response_text = improve_result["response"]
+                print(f"[AGENT {agent_num}] Iteration {iteration + 1} improvement completed")
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    record("draft", iteration=iteration + 1, filepath=os.path.abspath(filepath), text=f.read())
+            else:
+                print(f"[AGENT {agent_num}] Improvement failed: {improve_result['error']}")
+                improvement_error = improve_result['error']
+                break
+            
+            iteration += 1
+        
+        # Final result for this agent
+        result = {
+            "agent_number": agent_num,
+            "key_number": agent_key,
+            "task": variant_task,
+            "filepath": filepath,
+            "filename": os.path.basename(filepath),
+            "final_quality": current_quality,
+            "iterations": iteration,
+            "success": True
+        }
+        if improvement_error:
+            result["improvement_error"] = improvement_error
+        return result
+    
+    def _lost_race(self, agent_num, agent_key, variant_task, filepath):
+        """Remove a cancelled agent's report and return its result entry"""
+        winner = self._local.cancel.winner
+        if filepath:
+            if self.report_store is not None:
+                self.report_store.discard(os.path.abspath(filepath))
+            try:
+                os.remove(filepath)
+                print(f"[RACE] Agent {agent_num} cancelled, removed {os.path.basename(filepath)}")
+            except OSError as e:
+                print(f"[RACE] Agent {agent_num} cancelled, could not remove {filepath}: {e}")
+        else:
+            print(f"[RACE] Agent {agent_num} cancelled")
+        return {
+            "agent_number": agent_num,
+            "key_number": agent_key,
+            "task": variant_task,
+            "success": False,
+            "cancelled": True,
+            "error": f"Cancelled: agent {winner} reached the quality threshold first"
+        }
+    
+    def _start_speculation(self, filepath, improvement_points, key_number=None, original_task=None):
+        """Start improving the report at filepath in the background, without touching the file yet
+        
+        Returns a future for the _make_request result, or None if the report could not be read.
+        """
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                existing_content = f.read()
+        except OSError as e:
+            print(f"[SPECULATE] Could not read {filepath}: {e}")
+            return None
+        
+        with self._speculation_lock:
+            self._speculation_stats["started"] += 1
+        # The assessment running alongside reads the same report context, so either call may upload it
+        return self._speculation_executor.submit(self._with_cancel, getattr(self._local, "cancel", None),
+                                                 self._request_task_improvement, existing_content,
+                                                 improvement_points, key_number, original_task, "create")
+    
+    def _with_cancel(self, cancel, function, *args, **kwargs):
+        """Run function on this thread under the given race cancel token"""
+        self._local.cancel = cancel
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self._local.cancel = None
+    
+    def _finish_speculation(self, speculation, filepath, agent_num):
+        """Wait for a speculative improvement and write it to filepath; returns None if it failed"""
+        result = speculation.result()
+        if not result["success"]:
+            print(f"[AGENT {agent_num}] Speculative improvement failed ({result['error']}), improving directly")
+            return None
+        
+        with self._speculation_lock:
+            self._speculation_stats["kept"] += 1
+        print(f"[SPECULATE] Agent {agent_num} kept speculative improvement from {result['api_key_used']}")
+        return self._save_task_improvement(result, filepath)
+    
+    def _discard_speculation(self, speculation, agent_num):
+        """Drop a speculative improvement that is no longer needed
+        
+        A call that has not started yet is cancelled; one already in flight finishes in the
+        background and its result is ignored.
+        """
+        speculation.cancel()
+        with self._speculation_lock:
+            self._speculation_stats["discarded"] += 1
+        print(f"[SPECULATE] Agent {agent_num} discarded speculative improvement")
+    
+    def _request_task_improvement(self, existing_content, improvement_points, key_number=None, original_task=None,
+                                  cache_context="reuse"):
+        """Ask for an improved task report, section by section if it is over the chunk budget"""
+        if self._estimate_tokens(existing_content) > self.chunk_tokens:
+            return self._improve_in_sections(existing_content, improvement_points, "task completion report",
+                                             key_number)
+        context, prompt = self._task_improvement_prompt(existing_content, improvement_points, original_task)
+        return self._make_request(prompt, key_number, model=self.improvement_model, context=context,
+                                  cache_context=cache_context)
+    
+    def _improve_in_sections(self, existing_content, improvement_points, report_name, key_number=None):
+        """Improve an oversized report as heading-aligned chunks in parallel and stitch them back
+        
+        Returns a _make_request-style result whose response holds the stitched report. A chunk
+        whose call fails keeps its original text; the call fails only if every chunk did.
+        """
+        chunks = split_markdown_sections(existing_content, self.chunk_tokens, self._estimate_tokens)
+        print(f"[IMPROVE] Report is ~{self._estimate_tokens(existing_content)} tokens, "
+              f"improving it in {len(chunks)} sections of up to ~{self.chunk_tokens}")
+        
+        def improve_chunk(index, chunk):
+            prompt = f"""You are improving one part of a larger {report_name} that is too long to revise in a single pass.
+
+PART {index + 1} OF {len(chunks)}:
+{chunk}
+
+IMPROVEMENT POINTS FOR THE WHOLE REPORT:
+{improvement_points}
+
+INSTRUCTIONS:
+1. Improve only this part, addressing the improvement points that apply to it
+2. Keep its headings, order and markdown format so it fits back between the other parts
+3. Do not add an introduction, conclusion or commentary about the other parts
+4. Provide the complete improved part
+
+Please provide the complete improved part:"""
+            return self._make_request(prompt, key_number, model=self.improvement_model)
+        
+        cancel = getattr(self._local, "cancel", None)
+        workers = min(self.concurrency, len(chunks))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="section") as executor:
+            results = list(executor.map(lambda item: self._with_cancel(cancel, improve_chunk, *item),
+                                        enumerate(chunks)))
         
-        # Update key index for next use (only if not using pre-assigned keys)
-        if original_specific_key is None:
-            next_index = ((current_key_index - 1 + agent_count) % len(self.api_keys)) + 1
-            self._save_key_index(next_index)
+        failed = [i + 1 for i, result in enumerate(results) if not result["success"]]
+        if len(failed) == len(chunks):
+            return results[0]
+        if failed:
+            print(f"[IMPROVE] Section(s) {', '.join(map(str, failed))} failed and keep their original text")
         
+        parts = [self._extract_response_text(result["response"]) if result["success"] else chunk
+                 for chunk, result in zip(chunks, results)]
+        stitched = '\n\n'.join(part.strip('\n') for part in parts) + '\n'
+        keys = sorted({result["api_key_used"] for result in results if result["success"]})
         return {
             "success": True,
-            "agent_count": agent_count,
-            "results": results,
-            "task_description": task_description
+            "response": {"candidates": [{"content": {"parts": [{"text": stitched}], "role": "model"}}]},
+            "api_key_used": ', '.join(keys),
+            "sections": len(chunks)
         }
     
-    def improve_task(self, improvement_points, filename):
-        """Improve an existing task file based on improvement points"""
-        print(f"[IMPROVE] Improving task file: {filename}")
-        print(f"[IMPROVE] Improvement points: {improvement_points[:100]}...")
+    def _task_improvement_prompt(self, existing_content, improvement_points, original_task=None):
+        """Prompt asking for a complete improved version of a task report, as (context, prompt)
         
-        # Temporarily disable specific key for improvement
-        original_specific_key = self.specific_key
-        self.specific_key = None
+        With original_task the report is quoted in the same context block as the assessment's
+        (see _report_context), otherwise inline with no context.
+        """
+        if original_task is not None:
+            return self._report_context(original_task, existing_content), f"""You are tasked with improving the task completion report above (the TASK RESULT).
+
+IMPROVEMENT POINTS TO ADDRESS:
+{improvement_points}
+
+INSTRUCTIONS:
+1. Read and understand the existing task content above
+2. Address the specific improvement points mentioned
+3. Enhance the existing work while maintaining the overall structure
+4. Keep the same markdown format with the header information
+5. Provide the complete improved task report
+
+Please provide the complete improved task completion report:"""
         
-        try:
-            # Read existing file
-            if not os.path.exists(filename):
-                return {
-                    "success": False,
-                    "error": f"File not found: {filename}"
-                }
-            
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    existing_content = f.read()
-            except Exception as e:
-                return {
-                    "success": False,
-                    "error": f"Failed to read file: {e}"
-                }
-            
-            # Create improvement prompt
-            improvement_prompt = f"""You are tasked with improving an existing task completion report. 
+        return None, f"""You are tasked with improving an existing task completion report. 
 
 EXISTING TASK CONTENT:
 {existing_content}
@@ -655,70 +3241,74 @@ INSTRUCTIONS:
 5. Provide the complete improved task report
 
 Please provide the complete improved task completion report:"""
-            
-            # Make request to Gemini for improvement
-            result = self._make_request(improvement_prompt)
-            
-            if result["success"]:
-                improved_text = self._extract_response_text(result["response"])
-                print(f"[SUCCESS] Task improved using {result['api_key_used']}")
-                
-                # Write improved content back to the same file
-                try:
-                    with open(filename, 'w', encoding='utf-8') as f:
-                        f.write(improved_text)
-                    
-                    print(f"[UPDATED] File updated: {filename}")
-                    return {
-                        "success": True,
-                        "filepath": filename,
-                        "filename": os.path.basename(filename),
-                        "response": improved_text
-                    }
-                except Exception as e:
-                    return {
-                        "success": False,
-                        "error": f"Failed to write improved content: {e}"
-                    }
-            else:
-                print(f"[ERROR] Improvement failed: {result['error']}")
-                return {
-                    "success": False,
-                    "error": result['error']
-                }
+    
+    def _save_task_improvement(self, result, filename):
+        """Write a successful improvement response over the task file"""
+        return self._write_revision(filename, self._extract_response_text(result["response"]))
+    
+    def improve_task(self, improvement_points, filename, key_number=None, original_task=None):
+        """Improve an existing task file based on improvement points
         
-        finally:
-            # Restore original specific key setting
-            self.specific_key = original_specific_key
+        Passing original_task lets the prompt share its report context with the assessment.
+        """
+        print(f"[IMPROVE] Improving task file: {filename}")
+        print(f"[IMPROVE] Improvement points: {improvement_points[:100]}...")
+        
+        # Read existing file
+        if not os.path.exists(filename):
+            return {
+                "success": False,
+                "error": f"File not found: {filename}"
+            }
+        
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                existing_content = f.read()
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Failed to read file: {e}"
+            }
+        
+        # Create improvement prompt
+        # Make request to Gemini for improvement (uses key rotation for a fresh perspective unless pinned)
+        result = self._request_task_improvement(existing_content, improvement_points, key_number, original_task)
+        
+        if result["success"]:
+            print(f"[SUCCESS] Task improved using {result['api_key_used']}")
+            
+            # Write improved content back to the same file
+            return self._save_task_improvement(result, filename)
+        else:
+            print(f"[ERROR] Improvement failed: {result['error']}")
+            return {
+                "success": False,
+                "error": result['error']
+            }
     
     def improve(self, improvement_points, filename):
         """Improve an existing research file based on improvement points using fresh perspective"""
         print(f"[IMPROVE] Improving file: {filename}")
         print(f"[IMPROVE] Improvement points: {improvement_points[:100]}...")
         
-        # Temporarily disable specific key for improvement (use current index progression)
-        original_specific_key = self.specific_key
-        self.specific_key = None
+        # Read existing file
+        if not os.path.exists(filename):
+            return {
+                "success": False,
+                "error": f"File not found: {filename}"
+            }
         
         try:
-            # Read existing file
-            if not os.path.exists(filename):
-                return {
-                    "success": False,
-                    "error": f"File not found: {filename}"
-                }
-            
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    existing_content = f.read()
-            except Exception as e:
-                return {
-                    "success": False,
-                    "error": f"Failed to read file: {e}"
-                }
-            
-            # Create improvement prompt
-            improvement_prompt = f"""You are tasked with improving an existing research report. 
+            with open(filename, 'r', encoding='utf-8') as f:
+                existing_content = f.read()
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Failed to read file: {e}"
+            }
+        
+        # Create improvement prompt
+        improvement_prompt = f"""You are tasked with improving an existing research report. 
 
 EXISTING RESEARCH CONTENT:
 {existing_content}
@@ -734,61 +3324,312 @@ INSTRUCTIONS:
 5. Provide the complete improved report
 
 Please provide the complete improved research report:"""
+        
+        # Make request to Gemini for improvement (this will use and increment current key index)
+        if self._estimate_tokens(existing_content) > self.chunk_tokens:
+            result = self._improve_in_sections(existing_content, improvement_points, "research report")
+        else:
+            result = self._make_request(improvement_prompt, model=self.improvement_model)
+        
+        if result["success"]:
+            improved_text = self._extract_response_text(result["response"])
+            print(f"[SUCCESS] Research improved using {result['api_key_used']}")
             
-            # Make request to Gemini for improvement (this will use and increment current key index)
-            result = self._make_request(improvement_prompt)
-            
-            if result["success"]:
-                improved_text = self._extract_response_text(result["response"])
-                print(f"[SUCCESS] Research improved using {result['api_key_used']}")
+            # Write improved content back to the same file (filename stays consistent)
+            try:
+                with open(filename, 'w', encoding='utf-8') as f:
+                    f.write(improved_text)
                 
-                # Write improved content back to the same file (filename stays consistent)
-                try:
-                    with open(filename, 'w', encoding='utf-8') as f:
-                        f.write(improved_text)
-                    
-                    print(f"[UPDATED] File updated: {filename}")
-                    return {
-                        "success": True,
-                        "filepath": filename,
-                        "filename": os.path.basename(filename),
-                        "response": improved_text
-                    }
-                except Exception as e:
-                    return {
-                        "success": False,
-                        "error": f"Failed to write improved content: {e}"
-                    }
-            else:
-                print(f"[ERROR] Improvement failed: {result['error']}")
+                self._report_revised(filename, improved_text)
+                print(f"[UPDATED] File updated: {filename}")
+                return {
+                    "success": True,
+                    "filepath": filename,
+                    "filename": os.path.basename(filename),
+                    "response": improved_text
+                }
+            except Exception as e:
                 return {
                     "success": False,
-                    "error": result['error']
+                    "error": f"Failed to write improved content: {e}"
                 }
+        else:
+            print(f"[ERROR] Improvement failed: {result['error']}")
+            return {
+                "success": False,
+                "error": result['error']
+            }
+    
+    def _load_batch_jobs(self, jobs_path, max_iterations=3):
+        """Parse a JSONL batch file into job dicts; malformed lines become jobs that carry an error"""
+        jobs = []
+        with open(jobs_path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                job = {"id": str(line_number), "line": line_number, "type": "research"}
+                try:
+                    spec = json.loads(line)
+                    if not isinstance(spec, dict):
+                        raise ValueError("each line must be a JSON object")
+                    job["id"] = str(spec.get("id", line_number))
+                    job["type"] = spec.get("type", "research")
+                    job["prompt"] = spec.get("prompt") or spec.get("task")
+                    job["agents"] = int(spec.get("agents", 1))
+                    job["iterations"] = int(spec.get("iterations", max_iterations))
+                    job["documents"] = spec.get("documents")
+                    if job["type"] not in ("research", "delegate"):
+                        raise ValueError(f"unknown job type '{job['type']}' (use research or delegate)")
+                    if not job["prompt"]:
+                        raise ValueError("missing 'prompt'")
+                    if job["documents"] is not None and (job["type"] != "research" or not isinstance(job["documents"], list)):
+                        raise ValueError("'documents' must be a list of file paths on a research job")
+                    if not 1 <= job["agents"] <= 8 or not 1 <= job["iterations"] <= 10:
+                        raise ValueError("agents must be 1-8 and iterations 1-10")
+                except (ValueError, TypeError) as e:
+                    job["error"] = f"Invalid job on line {line_number}: {e}"
+                jobs.append(job)
+        return jobs
+    
+    def run_batch(self, jobs_path, results_path, output_dir="outputs", max_iterations=3):
+        """Run research/delegate jobs from a JSONL file on a bounded worker pool
         
-        finally:
-            # Restore original specific key setting
-            self.specific_key = original_specific_key
+        Jobs share this client (keys, pacing, cache and connection pool). One JSON result per job
+        is written to results_path in completion order, with timing and the key(s) used.
+        """
+        jobs = self._load_batch_jobs(jobs_path, max_iterations)
+        print(f"[BATCH] {len(jobs)} job(s) from {jobs_path}, up to {self.concurrency} at a time")
+        
+        succeeded = 0
+        with open(results_path, 'w', encoding='utf-8') as results_file, \
+                ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as executor:
+            futures = [executor.submit(self._run_batch_job, job, output_dir) for job in jobs]
+            for done, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                results_file.write(json.dumps(record) + "\n")
+                results_file.flush()
+                if record["success"]:
+                    succeeded += 1
+                status = "done" if record["success"] else f"failed: {record.get('error')}"
+                print(f"[BATCH] {done}/{len(jobs)} job {record['id']} {status} ({record['elapsed']:.1f}s)")
+        
+        return {
+            "success": True,
+            "total": len(jobs),
+            "succeeded": succeeded,
+            "failed": len(jobs) - succeeded,
+            "results_path": results_path
+        }
+    
+    def _run_batch_job(self, job, output_dir):
+        """Run one batch job and return its result record"""
+        record = {
+            "id": job["id"],
+            "line": job["line"],
+            "type": job["type"],
+            "started_at": datetime.now().isoformat(timespec='seconds')
+        }
+        started = time.monotonic()
+        
+        try:
+            if job.get("error"):
+                record.update(success=False, error=job["error"])
+            elif job["type"] == "research":
+                if job.get("documents"):
+                    result = self.research_documents(job["prompt"], job["documents"], output_dir)
+                else:
+                    result = self.research(job["prompt"], output_dir)
+                record.update(
+                    success=result["success"],
+                    filepath=result.get("filepath"),
+                    key_number=result.get("key_number"),
+                    api_key_used=result.get("api_key_used"),
+                    error=result.get("error")
+                )
+            else:
+                result = self.delegate_task(job["prompt"], job["agents"], job["iterations"], output_dir)
+                agents = [
+                    {field: agent_result.get(field) for field in
+                     ("agent_number", "key_number", "filepath", "final_quality", "iterations", "success", "error")}
+                    for agent_result in result["results"]
+                ]
+                record.update(
+                    success=any(agent["success"] for agent in agents),
+                    agents=agents
+                )
+        except Exception as e:
+            record.update(success=False, error=str(e))
+        
+        record["elapsed"] = round(time.monotonic() - started, 3)
+        return record
     
     def get_last_created_file(self):
         """Get the path of the last created file"""
         return self.last_created_file
 
+def print_delegation_summary(result, task_description, verbose=False):
+    """Print the per-agent summary shared by --delegate and --orchestrate"""
+    print(f"\n[DELEGATION COMPLETE] Task: {task_description}")
+    print(f"[SUMMARY] {result['agent_count']} agent(s) deployed")
+    
+    successful_agents = [r for r in result['results'] if r['success']]
+    failed_agents = [r for r in result['results'] if not r['success'] and not r.get('cancelled')]
+    cancelled_agents = [r for r in result['results'] if r.get('cancelled')]
+    
+    if result.get('run_id'):
+        print(f"[RUN] Run ID: {result['run_id']}")
+    
+    if successful_agents:
+        print(f"[SUCCESS] {len(successful_agents)} agent(s) completed successfully:")
+        for agent_result in successful_agents:
+            print(f"  - Agent {agent_result['agent_number']}: {agent_result['filename']} "
+                  f"(Quality: {agent_result['final_quality']}/10, Iterations: {agent_result['iterations']})")
+    
+    if failed_agents:
+        print(f"[FAILED] {len(failed_agents)} agent(s) failed:")
+        for agent_result in failed_agents:
+            print(f"  - Agent {agent_result['agent_number']}: {agent_result['error']}")
+    
+    if cancelled_agents:
+        print(f"[RACE] {len(cancelled_agents)} agent(s) cancelled after another reached the threshold: "
+              f"{', '.join(str(r['agent_number']) for r in cancelled_agents)}")
+    
+    if verbose and successful_agents:
+        print(f"\n[DETAILED RESULTS]")
+        for agent_result in successful_agents:
+            print(f"Agent {agent_result['agent_number']} Task: {agent_result['task'][:100]}...")
+
+def print_cache_stats(client):
+    """Print response cache hit/miss counts for this session"""
+    stats = client.cache.stats()
+    if stats["hit_rate"] is None:
+        return
+    print(f"\n[CACHE] {stats['hits']} hit(s), {stats['misses']} miss(es) "
+          f"({stats['hit_rate']:.0%} hit rate), {stats['writes']} new entr{'y' if stats['writes'] == 1 else 'ies'}")
+
+def print_report_rows(reports):
+    """Print report store rows, with their search snippet when there is one"""
+    if not reports:
+        print("[REPORTS] No matching reports")
+        return
+    for report in reports:
+        score = "-" if report["score"] is None else f"{report['score']:g}/10"
+        print(f"[{report['id']}] {report['created']} {report['kind']} agent={report['agent']} key={report['key_number']} "
+              f"model={report['model']} score={score} iteration={report['iteration']}")
+        print(f"     {os.path.basename(report['path'])}: {report['prompt'][:100]}")
+        if report.get("snippet"):
+            print(f"     {' '.join(report['snippet'].split())}")
+
+def print_dedup_stats(client):
+    """Print how many prompts matched a near-duplicate past report"""
+    index = client.dedup_index
+    if index.lookups:
+        print(f"[DEDUP] {index.matches}/{index.lookups} prompt(s) matched a past report "
+              f"({len(index.entries)} indexed, threshold {index.threshold:.0%})")
+
+def print_context_cache_stats(client):
+    """Print how many prompt prefixes were cached server-side and how often they were reused"""
+    cache = client.context_cache
+    if cache.created or cache.hits:
+        print(f"[CONTEXT CACHE] {cache.created} prefix cache(s) created, {cache.hits} reuse(s)")
+
+def print_key_health(client):
+    """Print per-key health stats collected during this session"""
+    print("\n[KEYS] Key health:")
+    for row in client.key_health.summary():
+        if not row["requests"] and row["state"] == "healthy":
+            continue
+        success_rate = f"{row['success_rate']:.0%}" if row["success_rate"] is not None else "n/a"
+        latency = f"{row['latency']:.1f}s" if row["latency"] is not None else "n/a"
+        print(f"  - Key {row['key_number']}: {row['state']}, {row['requests']} request(s), "
+              f"success {success_rate}, latency {latency}")
+    if client.hedge:
+        stats = client._hedge_stats
+        print(f"[HEDGE] {stats['hedges']} hedge(s) over {stats['calls']} call(s), {stats['wins']} won by the hedge")
+    if client.quality_mode == "pipelined":
+        stats = client._speculation_stats
+        print(f"[SPECULATE] {stats['started']} speculative improvement(s), {stats['kept']} kept, "
+              f"{stats['discarded']} discarded")
+
 def main():
     """Main CLI interface"""
     parser = argparse.ArgumentParser(description="Enhanced Gemini Client with Delegation Capabilities")
     parser.add_argument("--research", help="Research topic/prompt")
+    parser.add_argument("--docs", nargs="+", metavar="FILE",
+                       help="With --research, map-reduce the question over these Markdown documents")
     parser.add_argument("--delegate", help="Delegate any task to Gemini agents")
     parser.add_argument("--agents", type=int, default=1, help="Number of agents to spawn for delegation (1-8)")
     parser.add_argument("--iterations", type=int, default=3, help="Max iterations per agent for quality improvement")
+    parser.add_argument("--quality-mode", choices=["separate", "combined", "pipelined"], default="separate",
+                       help="separate: assess then improve (2 calls per iteration); "
+                            "combined: one critique-and-revise call per iteration; "
+                            "pipelined: improve speculatively while assessing (at most 1 wasted call per agent)")
+    parser.add_argument("--race", action="store_true",
+                       help="With several agents, stop the others (and remove their reports) once one reaches the threshold")
     parser.add_argument("--improve", nargs=2, metavar=('IMPROVEMENT_POINTS', 'FILENAME'), 
                        help="Improve existing research file. Usage: --improve 'improvement points' 'filename'")
     parser.add_argument("--orchestrate", nargs=2, metavar=('TASK', 'AGENT_COUNT'), 
                        help="Orchestrate multiple parallel agents with proper key management. Usage: --orchestrate 'task' N")
+    parser.add_argument("--resume", metavar="RUN_ID",
+                       help="Resume an interrupted --delegate/--orchestrate run from its journal in GEMINI_RUNS_DIR")
+    parser.add_argument("--batch", metavar="JOBS_JSONL",
+                       help="Run research/delegate jobs from a JSONL file on a worker pool")
+    parser.add_argument("--batch-output", metavar="RESULTS_JSONL",
+                       help="Where to write batch results (default: <JOBS>.results.jsonl)")
     parser.add_argument("--key", type=int, help="Specific API key number to use (1-20)")
-    parser.add_argument("-m", "--model", default="gemini-2.5-pro", help="Model to use")
-    parser.add_argument("-t", "--timeout", type=int, default=30, help="Request timeout")
+    parser.add_argument("-m", "--model", default="gemini-2.5-pro", help="Model used to generate reports")
+    parser.add_argument("--assess-model", help="Model used to grade reports (default: --model), e.g. gemini-2.5-flash")
+    parser.add_argument("--improve-model", help="Model used to improve reports (default: --model)")
+    parser.add_argument("-t", "--timeout", type=int, default=30,
+                       help="Minimum request timeout; actual timeouts adapt to observed latency")
+    parser.add_argument("--timeout-factor", type=float, default=2.0,
+                       help="Safety factor applied to observed p99 latency when deriving timeouts")
+    parser.add_argument("--max-timeout", type=int, default=300, help="Upper bound for adaptive timeouts")
     parser.add_argument("-o", "--output", default="outputs", help="Output directory")
+    parser.add_argument("--rpm", type=int, help="Requests per minute per key for --model (overrides built-in quota)")
+    parser.add_argument("--tpm", type=int, help="Tokens per minute per key for --model (overrides built-in quota)")
+    parser.add_argument("--assess-rpm", type=int, help="Requests per minute per key for the assessment model")
+    parser.add_argument("--assess-tpm", type=int, help="Tokens per minute per key for the assessment model")
+    parser.add_argument("--improve-rpm", type=int, help="Requests per minute per key for the improvement model")
+    parser.add_argument("--improve-tpm", type=int, help="Tokens per minute per key for the improvement model")
+    parser.add_argument("--no-pacing", action="store_true", help="Disable client-side quota pacing")
+    parser.add_argument("--max-attempts", type=int, default=10, help="Max attempts per API call before giving up")
+    parser.add_argument("--deadline", type=float, default=900, help="Max seconds per API call including retries")
+    parser.add_argument("--hedge", action="store_true",
+                       help="Duplicate calls that outlive the observed p95 latency onto a second key")
+    parser.add_argument("--hedge-ratio", type=float, default=0.1, help="Max hedged requests as a fraction of calls")
+    parser.add_argument("--context-cache", action="store_true",
+                       help="Cache large repeated prompt prefixes (task + current report) with Gemini's cachedContents API "
+                            "(only when --assess-model and --improve-model resolve to the same model)")
+    parser.add_argument("--context-ttl", type=int, default=600,
+                       help="TTL in seconds for context caches; they are deleted on exit (default: 600)")
+    parser.add_argument("--chunk-tokens", type=int,
+                       help="Improve reports larger than this many tokens section by section, and chunk --docs "
+                            "to this size (default: half the improvement model's output limit)")
+    parser.add_argument("--dedup", choices=["warn", "reuse"],
+                       help="Check new prompts against past reports (GEMINI_DEDUP_FILE index): list near-duplicates, "
+                            "or with 'reuse' return the closest research report instead of calling the API")
+    parser.add_argument("--dedup-threshold", type=float, default=0.7,
+                       help="Minimum estimated topic-word similarity (0-1] for --dedup to treat prompts as duplicates")
+    parser.add_argument("--store", choices=["files", "sqlite"], default="files",
+                       help="Also keep every report in a SQLite store (GEMINI_REPORT_DB) for fast listing and search")
+    parser.add_argument("--search", metavar="QUERY", help="Full-text search the report store")
+    parser.add_argument("--list-reports", action="store_true", help="List the newest reports in the report store")
+    parser.add_argument("--export", nargs="+", type=int, metavar="REPORT_ID",
+                       help="Write reports from the report store to the output directory as Markdown")
+    parser.add_argument("--kind", choices=sorted(REPORT_FORMATS), help="Only search/list reports of this kind")
+    parser.add_argument("--by-agent", type=int, help="Only search/list reports written by this agent number")
+    parser.add_argument("--limit", type=int, default=20, help="Maximum reports shown by --search/--list-reports")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the on-disk response cache")
+    parser.add_argument("--refresh-cache", action="store_true",
+                       help="Ignore cached responses but store fresh ones")
+    parser.add_argument("--stream", action="store_true",
+                       help="Stream generation and write report files incrementally")
+    parser.add_argument("--echo", action="store_true", help="Echo streamed text to stdout (with --stream)")
+    parser.add_argument("--stall-timeout", type=int, default=30,
+                       help="Seconds without streamed data before a stream counts as stalled")
+    parser.add_argument("-c", "--concurrency", type=int, default=8,
+                       help="Max API requests in flight (and agents or batch jobs running) at the same time")
     parser.add_argument("-v", "--verbose", action="store_true", help="Verbose output")
     
     args = parser.parse_args()
@@ -798,22 +3639,56 @@ def main():
         bool(args.research),
         bool(args.delegate), 
         bool(args.improve),
-        bool(args.orchestrate)
+        bool(args.orchestrate),
+        bool(args.batch),
+        bool(args.resume),
+        bool(args.search),
+        bool(args.list_reports),
+        bool(args.export)
     ])
     
     if action_count == 0:
-        print("Error: One of --research, --delegate, --orchestrate, or --improve flag is required")
+        print("Error: One of --research, --delegate, --orchestrate, --improve, --batch, --resume, --search, "
+              "--list-reports or --export flag is required")
         print("Usage:")
         print("  Research:    python gemini_client.py --research 'Your research topic'")
         print("  Delegate:    python gemini_client.py --delegate 'Your task' [--agents N] [--iterations M]")
         print("  Orchestrate: python gemini_client.py --orchestrate 'Your task' N")
         print("  Improve:     python gemini_client.py --improve 'improvement points' 'filename'")
+        print("  Batch:       python gemini_client.py --batch jobs.jsonl [--batch-output results.jsonl]")
+        print("  Resume:      python gemini_client.py --resume RUN_ID")
+        print("  Reports:     python gemini_client.py --search 'query' | --list-reports | --export ID [ID ...]")
         sys.exit(1)
     
     if action_count > 1:
-        print("Error: Only one of --research, --delegate, --orchestrate, or --improve can be used at a time")
+        print("Error: Only one of --research, --delegate, --orchestrate, --improve, --batch, --resume, --search, "
+              "--list-reports or --export can be used at a time")
         sys.exit(1)
     
+    if args.search or args.list_reports or args.export:
+        # Report store queries run offline, no API keys needed
+        db_path = os.getenv('GEMINI_REPORT_DB', '.gemini_reports.db')
+        if not os.path.exists(db_path):
+            print(f"Error: No report store at {db_path} (write reports with --store sqlite first)")
+            sys.exit(1)
+        store = SQLiteReportStore(db_path)
+        try:
+            if args.export:
+                for filepath in store.export(args.export, args.output):
+                    print(f"[EXPORTED] {filepath}")
+            else:
+                if args.search:
+                    reports = store.search(args.search, args.kind, args.by_agent, args.limit)
+                else:
+                    reports = store.list(args.kind, args.by_agent, args.limit)
+                print_report_rows(reports)
+        except (ValueError, OSError, sqlite3.Error) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        finally:
+            store.close()
+        return
+    
     # Validate that --key is not used with --improve
     if args.improve and args.key:
         print("Error: --key flag cannot be used with --improve flag")
@@ -831,24 +3706,102 @@ def main():
         print("The --orchestrate operation manages key assignments automatically")
         sys.exit(1)
     
+    # Validate orchestration parameters
+    if args.orchestrate:
+        try:
+            args.orchestrate[1] = int(args.orchestrate[1])
+        except ValueError:
+            print("Error: --orchestrate AGENT_COUNT must be a number")
+            sys.exit(1)
+        if args.orchestrate[1] < 1:
+            print("Error: --orchestrate AGENT_COUNT must be at least 1")
+            sys.exit(1)
+    
     # Validate delegation parameters
-    if args.delegate:
-        if args.agents < 1 or args.agents > 8:
+    if args.delegate or args.orchestrate or args.batch or args.resume:
+        if args.delegate and (args.agents < 1 or args.agents > 8):
             print("Error: --agents must be between 1 and 8")
             sys.exit(1)
         if args.iterations < 1 or args.iterations > 10:
             print("Error: --iterations must be between 1 and 10")
             sys.exit(1)
     
+    if args.concurrency < 1:
+        print("Error: --concurrency must be at least 1")
+        sys.exit(1)
+    
+    if args.timeout < 1 or args.timeout_factor <= 0:
+        print("Error: --timeout must be at least 1 and --timeout-factor must be positive")
+        sys.exit(1)
+    
+    if args.chunk_tokens is not None and args.chunk_tokens < 256:
+        print("Error: --chunk-tokens must be at least 256")
+        sys.exit(1)
+    
+    if not 0 < args.dedup_threshold <= 1:
+        print("Error: --dedup-threshold must be in (0, 1]")
+        sys.exit(1)
+    
+    if not 0 < args.hedge_ratio <= 1:
+        print("Error: --hedge-ratio must be in (0, 1]")
+        sys.exit(1)
+    
+    if args.max_attempts < 1 or args.deadline <= 0:
+        print("Error: --max-attempts must be at least 1 and --deadline must be positive")
+        sys.exit(1)
+    
+    role_quotas = [
+        (args.model, args.rpm, args.tpm),
+        (args.assess_model or args.model, args.assess_rpm, args.assess_tpm),
+        (args.improve_model or args.model, args.improve_rpm, args.improve_tpm),
+    ]
+    if any(limit is not None and limit < 1 for _, rpm, tpm in role_quotas for limit in (rpm, tpm)):
+        print("Error: --rpm, --tpm and their --assess-/--improve- forms must be at least 1")
+        sys.exit(1)
+    
+    # Per-model overrides; a role-specific flag wins when roles share a model
+    model_quotas = {}
+    for quota_model, rpm, tpm in role_quotas:
+        if rpm:
+            model_quotas.setdefault(quota_model, {})["rpm"] = rpm
+        if tpm:
+            model_quotas.setdefault(quota_model, {})["tpm"] = tpm
+    
+    client = None
+    report_store = None
     try:
-        client = EnhancedGeminiClient(model=args.model, timeout=args.timeout, specific_key=args.key)
+        if args.store == "sqlite":
+            report_store = SQLiteReportStore(os.getenv('GEMINI_REPORT_DB', '.gemini_reports.db'))
+        client = EnhancedGeminiClient(model=args.model, timeout=args.timeout, specific_key=args.key,
+                                      concurrency=args.concurrency,
+                                      assessment_model=args.assess_model, improvement_model=args.improve_model,
+                                      quotas=model_quotas or None,
+                                      pacing=not args.no_pacing,
+                                      retry_policy=RetryPolicy(max_attempts=args.max_attempts, deadline=args.deadline),
+                                      timeout_factor=args.timeout_factor, max_timeout=args.max_timeout,
+                                      hedge=args.hedge, max_hedge_ratio=args.hedge_ratio,
+                                      cache=not args.no_cache, refresh_cache=args.refresh_cache,
+                                      stream=args.stream, echo=args.echo, stream_stall_timeout=args.stall_timeout,
+                                      quality_mode=args.quality_mode, race=args.race,
+                                      context_cache=args.context_cache, context_ttl=args.context_ttl,
+                                      chunk_tokens=args.chunk_tokens,
+                                      dedup=args.dedup, dedup_threshold=args.dedup_threshold,
+                                      report_store=report_store)
         
         if args.research:
-            # Conduct research
-            result = client.research(args.research, args.output)
+            # Conduct research (map-reduced over local documents with --docs)
+            if args.docs:
+                result = client.research_documents(args.research, args.docs, args.output)
+            else:
+                result = client.research(args.research, args.output)
             
             if result["success"]:
                 print(f"[SUCCESS] Research completed successfully")
+                if result.get("reused"):
+                    print(f"[DEDUP] Reused a {result['similarity']:.0%} match for: {result['similar_prompt'][:100]}")
+                if args.docs:
+                    print(f"[MAP-REDUCE] {result['chunks']} chunk(s): {result['cached_chunks']} from cache, "
+                          f"{result['failed_chunks']} failed")
                 print(f"[FILE] Created: {result['filepath']}")
                 print(f"[NAME] Filename: {result['filename']}")
                 
@@ -863,31 +3816,46 @@ def main():
             result = client.delegate_task(args.delegate, args.agents, args.iterations, args.output)
             
             if result["success"]:
-                print(f"\n[DELEGATION COMPLETE] Task: {args.delegate}")
-                print(f"[SUMMARY] {result['agent_count']} agent(s) deployed")
-                
-                successful_agents = [r for r in result['results'] if r['success']]
-                failed_agents = [r for r in result['results'] if not r['success']]
-                
-                if successful_agents:
-                    print(f"[SUCCESS] {len(successful_agents)} agent(s) completed successfully:")
-                    for agent_result in successful_agents:
-                        print(f"  - Agent {agent_result['agent_number']}: {agent_result['filename']} "
-                              f"(Quality: {agent_result['final_quality']}/10, Iterations: {agent_result['iterations']})")
-                
-                if failed_agents:
-                    print(f"[FAILED] {len(failed_agents)} agent(s) failed:")
-                    for agent_result in failed_agents:
-                        print(f"  - Agent {agent_result['agent_number']}: {agent_result['error']}")
-                
-                if args.verbose and successful_agents:
-                    print(f"\n[DETAILED RESULTS]")
-                    for agent_result in successful_agents:
-                        print(f"Agent {agent_result['agent_number']} Task: {agent_result['task'][:100]}...")
+                print_delegation_summary(result, args.delegate, args.verbose)
             else:
                 print(f"[FAILED] Task delegation failed")
                 sys.exit(1)
         
+        elif args.orchestrate:
+            # Fan agents out across keys, one pinned key per agent
+            task, agent_count = args.orchestrate
+            result = client.orchestrate(task, agent_count, args.iterations, args.output)
+            
+            if result["success"]:
+                print_delegation_summary(result, task, args.verbose)
+            else:
+                print(f"[FAILED] Orchestration failed: {result['error']}")
+                sys.exit(1)
+        
+        elif args.resume:
+            # Continue a journaled delegation run
+            result = client.resume_run(args.resume)
+            
+            if result["success"]:
+                print_delegation_summary(result, result["task_description"], args.verbose)
+            else:
+                print(f"[FAILED] Resume failed: {result['error']}")
+                sys.exit(1)
+        
+        elif args.batch:
+            # Run many jobs through one shared client
+            results_path = args.batch_output or f"{os.path.splitext(args.batch)[0]}.results.jsonl"
+            try:
+                result = client.run_batch(args.batch, results_path, args.output, args.iterations)
+            except OSError as e:
+                print(f"[FAILED] Batch failed: {e}")
+                sys.exit(1)
+            
+            print(f"\n[BATCH COMPLETE] {result['succeeded']}/{result['total']} job(s) succeeded")
+            print(f"[FILE] Results: {result['results_path']}")
+            if result["failed"]:
+                sys.exit(1)
+        
         elif args.improve:
             # Improve existing research/task
             improvement_points, filename = args.improve
@@ -907,6 +3875,19 @@ def main():
     except ValueError as e:
         print(f"Error: {e}")
         sys.exit(1)
+    finally:
+        if client:
+            if client.cache:
+                print_cache_stats(client)
+            if client.context_cache:
+                print_context_cache_stats(client)
+            if client.dedup_index:
+                print_dedup_stats(client)
+            if args.verbose:
+                print_key_health(client)
+            client.close()
+        if report_store:
+            report_store.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file